@@ -0,0 +1,102 @@
+#
+# Monte Carlo balance runner: lots of bot games, fanned out over a process pool
+#
+# usage: python balance.py [--games N] [--processes N] [--turns N] [--seed N]
+#                          [--policy greedy|random] [--race NAME ...]
+#
+# plays every seed from --seed on with every race (the same dungeons for all
+# races, so they are compared like for like) using the bots in botsim.py, one
+# game per task in a multiprocessing pool of one process per core by
+# default. once they are all in, prints a summary per race: how many died,
+# the depth they got to, kills, xp and turns per game, how often games ended
+# at each depth, and how many of each item got used per game. the numbers
+# only depend on the seeds and the game, not on how many processes ran them,
+# so a tweak to the spawn tables or PLAYABLE_RACES can be judged by running
+# the same sweep before and after.
+#
+
+import argparse
+import multiprocessing
+import time
+
+import botsim
+import firstrl as game
+
+
+def play_task(task):
+    # one game in a worker process: (seed, race index, policy name, max turns) -> the result from botsim.play
+    (seed, race, policy, max_turns) = task
+    return botsim.play(botsim.POLICIES[policy](race, seed), seed, max_turns)
+
+
+def summarize(results, races):
+    # per race: (race, games, deaths, depths, kills, xp, turns, items used), in the order of races
+    summary = []
+    for race in races:
+        games = [result for result in results if result['race'] == race]
+        items = {}
+        for result in games:
+            for (name, uses) in result['items_used'].items():
+                items[name] = items.get(name, 0) + uses
+        summary.append((race, len(games), sum(1 for result in games if result['state'] == 'dead'),
+                        [result['depth'] for result in games], sum(result['kills'] for result in games),
+                        sum(result['xp'] for result in games), sum(result['turns'] for result in games), items))
+    return summary
+
+
+def print_summary(summary):
+    print('%-8s %6s %6s %8s %6s %8s %8s %8s' % ('race', 'games', 'died', 'depth', 'max', 'kills', 'xp', 'turns'))
+    for (race, games, deaths, depths, kills, xp, turns, items) in summary:
+        n = max(games, 1)
+        print('%-8s %6d %5.1f%% %8.2f %6d %8.1f %8.1f %8.0f' % (race, games, 100.0 * deaths / n, float(sum(depths)) / n,
+                                                              max(depths or [0]), float(kills) / n, float(xp) / n,
+                                                              float(turns) / n))
+
+    print('')
+    deepest = max([max(depths or [0]) for (race, games, deaths, depths, kills, xp, turns, items) in summary] or [0])
+    print('games ending at each depth')
+    print('%-8s %s' % ('race', ' '.join('%6d' % depth for depth in range(deepest + 1))))
+    for (race, games, deaths, depths, kills, xp, turns, items) in summary:
+        print('%-8s %s' % (race, ' '.join('%6d' % depths.count(depth) for depth in range(deepest + 1))))
+
+    print('')
+    names = sorted(set(name for entry in summary for name in entry[7]))
+    print('items used per game')
+    for (race, games, deaths, depths, kills, xp, turns, items) in summary:
+        print('%-8s %s' % (race, ', '.join('%s %.2f' % (name, float(items.get(name, 0)) / max(games, 1)) for name in names)
+                           or 'none'))
+
+
+def main():
+    races = [race['name'] for race in game.PLAYABLE_RACES]
+    parser = argparse.ArgumentParser(description='play lots of seeded bot games in parallel and sum them up per race')
+    parser.add_argument('--games', type=int, default=100, help='seeds to play, each of them once per race')
+    parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--turns', type=int, default=5000, help='player turns per game at most')
+    parser.add_argument('--seed', type=int, default=1, help='first seed, the others count up from it')
+    parser.add_argument('--policy', choices=sorted(botsim.POLICIES), default='greedy')
+    parser.add_argument('--race', choices=races, action='append', help='race to play, can be repeated (default: all)')
+    args = parser.parse_args()
+
+    played = [races.index(race) for race in args.race or races]
+    tasks = [(seed, race, args.policy, args.turns) for seed in range(args.seed, args.seed + args.games) for race in played]
+    start = time.time()
+    pool = multiprocessing.Pool(args.processes)
+    results = []
+    try:
+        #one game per task, handed out as workers free up, so a few long games don't hold the others back
+        for result in pool.imap_unordered(play_task, tasks, 1):
+            results.append(result)
+    finally:
+        pool.terminate()
+    results.sort(key=lambda result: (result['seed'], result['race']))
+    elapsed = time.time() - start
+
+    print('%d games (%s policy, %d turns at most) in %.1fs on %d processes' % (len(results), args.policy, args.turns,
+                                                                               elapsed, args.processes))
+    print('')
+    print_summary(summarize(results, [races[race] for race in played]))
+
+
+if __name__ == '__main__':
+    main()
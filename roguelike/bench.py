@@ -0,0 +1,252 @@
+#
+# benchmarks of the game's hot paths
+#
+# usage: python bench.py [--out FILE.json] [--compare OLD.json] [--samples N]
+#                        [--map SIZE] [--monsters N] [--seed N] [NAME ...]
+#
+# times make_map, render_all, initialize_fov, a round of the Ticker, is_blocked,
+# Object.move_towards, save_game, load_game and message in a synthetic world
+# made from a fixed seed: a dungeon level of --map x --map tiles with
+# --monsters orcs on top of what make_map places, and a full inventory. every
+# benchmark gets a world of its own, so what one does doesn't show in the
+# next. each sample times a batch of calls (one for the slow paths, many for
+# the quick ones), and the report gives the calls per second and the
+# 50th/90th/99th percentile time of one call. --out writes the results as
+# JSON, and --compare prints how they changed since an earlier run, so two
+# commits can be held against each other. name some benchmarks to only run
+# those.
+#
+# LIBTCOD_BACKEND defaults to headless here, so this runs on a box with no
+# display and no libtcod.so. the console and FOV functions then run in
+# libtcodheadless.py, which is much slower than the C library: only compare
+# runs made with the same backend.
+#
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+os.environ.setdefault('LIBTCOD_BACKEND', 'headless')
+
+import libtcodpy as libtcod
+import firstrl as game
+
+timer = getattr(time, 'perf_counter', time.time)
+
+PERCENTILES = [50, 90, 99]
+MESSAGE = 'The orc attacks the player for 4 hit points, and the player attacks the orc back for 5 hit points.'
+
+
+class Autopilot(object):
+    # picks the first race and every first menu option, and never targets anything
+    def choose(self, header, options):
+        return 0
+
+    def target(self, max_range):
+        return (None, None)
+
+
+def make_world(seed, size, monsters):
+    # a fresh game on the first dungeon level (depth 0 is one big room), with extra monsters and a full
+    # inventory. the player can't die, so the monsters keep at it for as long as a benchmark runs
+    game.autopilot = Autopilot()
+    game.GAME_SEED = seed
+    game.MAP_WIDTH = game.MAP_HEIGHT = size  # make_map tries as many rooms as the area calls for
+    game.new_game()
+    game.depth = 1
+    game.make_map()
+    game.initialize_fov()
+    (game.key, game.mouse) = (libtcod.Key(), libtcod.Mouse())
+    game.player.fighter.base_max_hp = game.player.fighter.hp = 10 ** 9
+
+    rng = random.Random(seed)
+    free = [(x, y) for y in range(size) for x in range(size) if not game.is_blocked(x, y)]
+    for (x, y) in rng.sample(free, min(monsters, len(free))):
+        if not game.is_blocked(x, y):
+            fighter_component = game.Fighter(hp=20, defense=0, power=4, speed=12, xp=35, death_function=game.monster_death)
+            monster = game.Object(x, y, 'o', 'orc', libtcod.light_green, blocks=True, fighter=fighter_component,
+                                  ai=game.BasicMonster())
+            game.objects.append(monster)
+            game.object_index.add(monster)
+    while len(game.inventory) < 26:
+        game.inventory.append(game.Object(0, 0, '!', 'healing potion', libtcod.violet, item=game.Item(use_function=game.cast_heal)))
+    return rng
+
+
+# every benchmark sets up its world and returns (function timed per sample, calls the function makes)
+
+def bench_make_map(args):
+    make_world(args.seed, args.map, args.monsters)
+    return (game.make_map, 1)
+
+
+def bench_render_all(args):
+    # the player steps back and forth, so every frame works out the FOV again and scrolls the map console
+    make_world(args.seed, args.map, args.monsters)
+    player = game.player
+    tiles = [(player.x, player.y)] + [(player.x + dx, player.y) for dx in (1, -1) if not game.is_blocked(player.x + dx, player.y)][:1]
+    steps = [0]
+
+    def render():
+        steps[0] += 1
+        game.object_index.move(player, *tiles[steps[0] % len(tiles)])
+        game.fov_recompute = True
+        game.render_all()
+    game.render_all()
+    return (render, 1)
+
+
+def bench_initialize_fov(args):
+    # a new FOV map, filled from the tiles under the camera like render_all does first thing
+    make_world(args.seed, args.map, args.monsters)
+
+    def build():
+        game.fov_window = None
+        game.initialize_fov()
+        game.update_fov_window()
+    return (build, 1)
+
+
+def bench_ticker(args):
+    # one player turn's worth of monster turns (Ticker.advance calling next_turn for everything due)
+    make_world(args.seed, args.map, args.monsters)
+    return (lambda: game.ticker.advance(game.player.fighter.speed), 1)
+
+
+def bench_is_blocked(args):
+    rng = make_world(args.seed, args.map, args.monsters)
+    tiles = [(rng.randrange(args.map), rng.randrange(args.map)) for i in range(1000)]
+
+    def check():
+        for (x, y) in tiles:
+            game.is_blocked(x, y)
+    return (check, len(tiles))
+
+
+def bench_move_towards(args):
+    rng = make_world(args.seed, args.map, args.monsters)
+    monsters = [obj for obj in game.objects if obj.ai][:100]
+    targets = [(rng.randrange(args.map), rng.randrange(args.map)) for obj in monsters]
+
+    def move():
+        for (monster, (x, y)) in zip(monsters, targets):
+            if (monster.x, monster.y) != (x, y):
+                monster.move_towards(x, y)
+    return (move, len(monsters))
+
+
+def bench_save_game(args):
+    make_world(args.seed, args.map, args.monsters)
+    return (game.save_game, 1)
+
+
+def bench_load_game(args):
+    make_world(args.seed, args.map, args.monsters)
+    game.save_game()
+    return (game.load_game, 1)
+
+
+def bench_message(args):
+    make_world(args.seed, args.map, args.monsters)
+
+    def say():
+        for i in range(100):
+            game.message(MESSAGE)
+    return (say, 100)
+
+
+BENCHMARKS = [
+    ('make_map', bench_make_map),
+    ('render_all', bench_render_all),
+    ('initialize_fov', bench_initialize_fov),
+    ('ticker', bench_ticker),
+    ('is_blocked', bench_is_blocked),
+    ('move_towards', bench_move_towards),
+    ('save_game', bench_save_game),
+    ('load_game', bench_load_game),
+    ('message', bench_message),
+]
+
+
+def percentile(ordered, p):
+    # nearest-rank percentile of a sorted list
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered))) - 1))]
+
+
+def run(setup, args):
+    (function, calls) = setup(args)
+    function()  # once to warm up
+    samples = []
+    for i in range(args.samples):
+        start = timer()
+        function()
+        samples.append((timer() - start) / calls)
+    ordered = sorted(samples)
+    result = {
+        'samples': len(samples),
+        'calls_per_sample': calls,
+        'ops_per_sec': len(samples) / max(sum(samples), 1e-12),
+        'mean_ms': 1000.0 * sum(samples) / len(samples),
+        'max_ms': 1000.0 * ordered[-1],
+    }
+    for p in PERCENTILES:
+        result['p%d_ms' % p] = 1000.0 * percentile(ordered, p)
+    return result
+
+
+def main():
+    names = [name for (name, setup) in BENCHMARKS]
+    parser = argparse.ArgumentParser(description="time the game's hot paths in a synthetic world")
+    parser.add_argument('only', nargs='*', metavar='NAME', help='benchmarks to run (default: all of %s)' % ', '.join(names))
+    parser.add_argument('--out', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of an earlier run to compare against')
+    parser.add_argument('--samples', type=int, default=30, help='timed samples per benchmark')
+    parser.add_argument('--map', type=int, default=200, help='width and height of the map')
+    parser.add_argument('--monsters', type=int, default=400, help='monsters to add to the level')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    for name in args.only:
+        if name not in names:
+            parser.error('unknown benchmark %r' % name)
+
+    save_dir = tempfile.mkdtemp()
+    game.SAVE_FILE = os.path.join(save_dir, 'savegame')
+    report = {
+        'settings': {'samples': args.samples, 'map': args.map, 'monsters': args.monsters, 'seed': args.seed},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'backend': 'headless' if libtcod.HEADLESS else 'libtcod', 'fov_engine': game.FOV_ENGINE},
+        'results': {},
+    }
+    try:
+        for (name, setup) in BENCHMARKS:
+            if not args.only or name in args.only:
+                report['results'][name] = run(setup, args)
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+    print('%-16s %12s %10s %10s %10s%s' % ('benchmark', 'ops/s', 'p50 ms', 'p90 ms', 'p99 ms', '   vs old' if old else ''))
+    for (name, setup) in BENCHMARKS:
+        result = report['results'].get(name)
+        if result is None:
+            continue
+        change = ''
+        if old and name in old:
+            change = '  %+6.1f%%' % (100.0 * (result['ops_per_sec'] / old[name]['ops_per_sec'] - 1))
+        print('%-16s %12.1f %10.3f %10.3f %10.3f%s' % (name, result['ops_per_sec'], result['p50_ms'], result['p90_ms'],
+                                                       result['p99_ms'], change))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+#
+# headless batch simulator: the game played by bots, with nothing drawn
+#
+# usage: python botsim.py [--policy greedy|random] [--games N] [--turns N]
+#                         [--seed N] [--race NAME]
+#
+# every game goes through the same new_game, make_map, Fighter and Ticker
+# code as a real one. each turn the bot looks around (firstrl.look_around,
+# the FOV and exploring part of render_all), levels up if it has to, and
+# acts through the game's own functions (player_move_or_attack, Item.use,
+# next_level...), and then the monsters take their turns. the race menu,
+# level up menu and spell targeting are answered by the bot through
+# firstrl.autopilot instead of the keyboard and mouse. prints how every game
+# went and the turns per second, to soak-test a build and to catch speed
+# regressions.
+#
+# LIBTCOD_BACKEND defaults to headless here, so no display or libtcod.so is
+# needed.
+#
+
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('LIBTCOD_BACKEND', 'headless')
+
+import libtcodpy as libtcod
+import firstrl as game
+
+HEAL_BELOW = 0.4  # drink a healing potion below this fraction of max hp
+LEVEL_UP_ORDER = [0, 1, 0, 2]  # constitution, strength, constitution, agility, and again
+PATH_WINDOW = 32  # half the side of the first square searched for a path, doubled until something turns up
+
+# 8 neighbours of a tile
+DIRECTIONS = [(-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)]
+
+
+class Bot(object):
+    # a bot policy: answers the game's menus and targeting (as firstrl.autopilot) and plays
+    # the player's turns. act() returns 'didnt-take-turn' for free actions, like handle_keys
+    looks = True  # whether the FOV is worked out for it every turn, which is most of what a turn costs
+
+    def __init__(self, race=0, seed=0):
+        self.race = race
+        self.rng = random.Random(seed)
+        self.kills = 0
+        self.xp = 0
+        self.items_used = {}
+
+    def choose(self, header, options):
+        if header.startswith('Choose Race'):
+            return self.race
+        if header.startswith('Level up'):
+            return LEVEL_UP_ORDER[game.player.level % len(LEVEL_UP_ORDER)]
+        return 0  # message boxes and anything else: any key will do
+
+    def target(self, max_range):
+        # spells are aimed at the closest monster in view
+        monster = game.closest_monster(max_range)
+        if monster is None:
+            return (None, None)
+        return (monster.x, monster.y)
+
+    def act(self):
+        # a bot that does nothing lets every turn go by
+        return self.wait()
+
+    def step(self, dx, dy):
+        # move or attack, counting what that kills
+        x = game.player.x + dx
+        y = game.player.y + dy
+        self.watch([obj for obj in game.object_index.at(x, y) if obj.fighter], game.player_move_or_attack, dx, dy)
+
+    def wait(self):
+        # let a turn go by
+        pass
+
+    def use(self, use_function, victims=()):
+        # use the first item in the inventory with that use function, if there is one
+        for obj in game.inventory:
+            if obj.item.use_function is use_function:
+                self.items_used[obj.name] = self.items_used.get(obj.name, 0) + 1
+                self.watch(victims, obj.item.use)
+                return True
+        return False
+
+    def watch(self, victims, function, *args):
+        # call function, then count the victims that died of it
+        alive = [(obj, obj.fighter.xp) for obj in victims if obj.fighter and obj is not game.player]
+        function(*args)
+        for (obj, xp) in alive:
+            if obj.fighter is None:
+                self.kills += 1
+                self.xp += xp
+
+    def pick_up(self):
+        # pick up whatever lies on the player's tile, wielding anything better than what's equipped
+        for obj in list(game.object_index.at(game.player.x, game.player.y)):
+            if obj.item and obj in game.objects:
+                obj.item.pick_up()
+                equipment = obj.equipment
+                if equipment and not equipment.is_equipped and obj in game.inventory:
+                    current = game.get_equipped_in_slot(equipment.slot)
+                    if current is None or bonus_total(equipment) > bonus_total(current):
+                        equipment.equip()
+                return True
+        return False
+
+
+class RandomBot(Bot):
+    # stumbles around at random, fights whatever is next to it and takes any stairs it finds. it
+    # never looks, so it measures the game logic on its own
+    looks = False
+
+    def act(self):
+        player = game.player
+        if self.pick_up():
+            return 'didnt-take-turn'
+        if (game.stairs.x, game.stairs.y) == (player.x, player.y):
+            game.next_level()
+            return 'didnt-take-turn'
+        for (dx, dy) in DIRECTIONS:
+            for obj in game.object_index.at(player.x + dx, player.y + dy):
+                if obj.fighter and obj is not player:
+                    self.step(dx, dy)
+                    return
+        self.step(*self.rng.choice(DIRECTIONS))
+
+
+class GreedyBot(Bot):
+    # explores the level, fighting every monster it sees and picking up every item, then goes down
+    def __init__(self, race=0, seed=0):
+        super(GreedyBot, self).__init__(race, seed)
+        self.path = []  # tiles still to walk, the next one first
+        self.goal = None  # (map, tile) the path leads to
+        self.hunting = False  # whether the path leads to where a monster was last seen
+
+    def act(self):
+        player = game.player
+        fighter = player.fighter
+        if self.pick_up():
+            return 'didnt-take-turn'
+        if fighter.hp < fighter.max_hp * HEAL_BELOW and self.use(game.cast_heal):
+            return 'didnt-take-turn'
+
+        monster = game.closest_monster(game.TORCH_RADIUS)
+        if monster is not None:
+            distance = player.distance_to(monster)
+            if distance < 2:
+                return self.step(monster.x - player.x, monster.y - player.y)
+            if monster.fighter.hp > fighter.power:
+                if distance <= game.LIGHTNING_RANGE and self.use(game.cast_lightning, [monster]):
+                    return 'didnt-take-turn'
+                if distance > game.FIREBALL_RADIUS + 1:
+                    near = [obj for obj in game.objects if obj.fighter and monster.distance_to(obj) <= game.FIREBALL_RADIUS]
+                    if self.use(game.cast_fireball, near):
+                        return 'didnt-take-turn'
+            if (distance <= game.CONFUSE_RANGE and fighter.hp < fighter.max_hp // 2
+                    and not isinstance(monster.ai, game.ConfusedMonster) and self.use(game.cast_confuse)):
+                return 'didnt-take-turn'
+            #head for it, and keep going to where it was even if it gets out of view
+            self.path = find_path([(monster.x, monster.y)], half=game.TORCH_RADIUS) or []
+            self.goal = (game.map, (monster.x, monster.y))
+            self.hunting = True
+            return self.walk(self.path)
+
+        if (game.stairs.x, game.stairs.y) == (player.x, player.y) and self.goal == (game.map, (player.x, player.y)):
+            self.path = []
+            game.next_level()
+            return 'didnt-take-turn'
+
+        if not self.path or self.goal[0] is not game.map or not (self.hunting or self.still_worth_it(self.goal[1])):
+            self.hunting = False
+            #the nearest unexplored tile or item in view, and the stairs once there are none left
+            items = [(obj.x, obj.y) for obj in game.objects if obj.item and game.in_fov(obj.x, obj.y)]
+            path = find_path(items, explore=True)
+            if path is None:
+                path = find_path([(game.stairs.x, game.stairs.y)])
+            self.path = path or []
+            self.goal = (game.map, self.path[-1] if self.path else (player.x, player.y))
+            if not self.path:
+                return self.wait()
+        return self.walk(self.path)
+
+    def still_worth_it(self, tile):
+        # whether the tile the path leads to is still unexplored, or still has an item or the stairs on it
+        (x, y) = tile
+        return (not game.map.get(game.TileMap.EXPLORED, x, y) or (x, y) == (game.stairs.x, game.stairs.y)
+                or any(obj.item for obj in game.object_index.at(x, y)))
+
+    def walk(self, path):
+        # take the next step of a path, waiting a turn if there is none
+        if not path:
+            return self.wait()
+        (x, y) = path.pop(0)
+        return self.step(x - game.player.x, y - game.player.y)
+
+
+POLICIES = {'greedy': GreedyBot, 'random': RandomBot}
+
+
+def bonus_total(equipment):
+    return sum(getattr(equipment, bonus) for bonus in game.EQUIPMENT_BONUSES)
+
+
+def find_path(targets, explore=False, half=PATH_WINDOW):
+    # breadth-first search from the player to the nearest walkable tile of targets, or with explore
+    # set the nearest one that is in targets or unexplored, through walls only (monsters in the way
+    # get attacked). returns the tiles to walk, or None. searches a square around the player
+    # (half tiles to each side) first, and bigger ones until a goal is in one
+    player = game.player
+    while True:
+        left = max(0, player.x - half)
+        top = max(0, player.y - half)
+        w = min(game.map.width, player.x + half + 1) - left
+        h = min(game.map.height, player.y + half + 1) - top
+        path = search(targets, explore, left, top, w, h)
+        if path is not None or (w == game.map.width and h == game.map.height):
+            return path
+        half *= 2
+
+
+def search(targets, explore, left, top, w, h):
+    # the goals are worked out as indexes into the square once, so that the search itself only
+    # looks at the planes it read
+    blocked = game.map.region(game.TileMap.BLOCKED, left, top, w, h)
+    explored = game.map.region(game.TileMap.EXPLORED, left, top, w, h) if explore else None
+    goals = set((y - top) * w + x - left for (x, y) in targets if left <= x < left + w and top <= y < top + h)
+    start = (game.player.y - top) * w + game.player.x - left
+    came_from = {start: None}
+    frontier = [start]
+    for i in frontier:
+        if i != start and (i in goals or explored is not None and not explored[i]):
+            path = []
+            while i != start:
+                (y, x) = divmod(i, w)
+                path.append((left + x, top + y))
+                i = came_from[i]
+            path.reverse()
+            return path
+        (y, x) = divmod(i, w)
+        for (dx, dy) in DIRECTIONS:
+            if 0 <= x + dx < w and 0 <= y + dy < h:
+                n = i + dy * w + dx
+                if n not in came_from and not blocked[n]:
+                    came_from[n] = i
+                    frontier.append(n)
+    return None
+
+
+def play(bot, seed, max_turns):
+    # play one game with a bot, until it dies or max_turns player turns are up
+    game.GAME_SEED = seed
+    game.autopilot = bot
+    game.new_game()
+    turns = 0
+    free_actions = 0
+    while game.game_state == 'playing' and turns < max_turns:
+        if bot.looks:
+            game.look_around()
+        game.check_level_up()
+        #free actions (picking up, using items, taking the stairs) don't end the turn, but a bot stuck
+        #doing only those gets its turn ended for it
+        if bot.act() == 'didnt-take-turn' and free_actions < 100:
+            free_actions += 1
+            continue
+        free_actions = 0
+        if game.game_state == 'playing':
+            game.ticker.advance(game.player.fighter.speed)
+            turns += 1
+    return {
+        'seed': seed,
+        'race': game.PLAYABLE_RACES[bot.race]['name'],
+        'state': game.game_state,
+        'turns': turns,
+        'depth': game.depth,
+        'level': game.player.level,
+        'kills': bot.kills,
+        'xp': bot.xp,
+        'items_used': bot.items_used,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='play the game with bots, with nothing drawn')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='greedy')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=5000, help='player turns per game at most')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the first game, the others count up from it')
+    parser.add_argument('--race', choices=[race['name'] for race in game.PLAYABLE_RACES], default=None,
+                        help='race to play (default: every race in turn)')
+    args = parser.parse_args()
+
+    names = [race['name'] for race in game.PLAYABLE_RACES]
+    total_turns = 0
+    start = time.time()
+    print('%-8s %-6s %-6s %6s %6s %6s %6s %10s' % ('seed', 'race', 'state', 'turns', 'depth', 'kills', 'xp', 'turns/s'))
+    for n in range(args.games):
+        seed = args.seed + n
+        race = names.index(args.race) if args.race else n % len(names)
+        game_start = time.time()
+        result = play(POLICIES[args.policy](race, seed), seed, args.turns)
+        elapsed = time.time() - game_start
+        total_turns += result['turns']
+        print('%-8d %-6s %-6s %6d %6d %6d %6d %10.0f' % (seed, result['race'], result['state'], result['turns'],
+                                                        result['depth'], result['kills'], result['xp'],
+                                                        result['turns'] / max(elapsed, 1e-9)))
+    elapsed = time.time() - start
+    print('%d games, %d turns in %.2fs: %.0f turns/s' % (args.games, total_turns, elapsed, total_turns / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
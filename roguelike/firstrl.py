@@ -1,8 +1,25 @@
 #Graphics Library Input
 import libtcodpy as libtcod
+import shadowcast
+import atexit
+import binascii
 import math
+import multiprocessing
+import os
+import threading
 import textwrap
-import shelve
+import struct
+import zlib
+import heapq
+import json
+import tempfile
+import time
+import timeit
+from collections import deque
+try:
+	import lzma
+except ImportError:
+	lzma = None
 
 #Constant variables
 
@@ -18,6 +35,10 @@ CAMERA_HEIGHT = 43
 MAP_WIDTH = 100
 MAP_HEIGHT = 100
 
+#the map is kept in square chunks, and only this many of them stay in memory (the rest wait in a swap file)
+CHUNK_SIZE = 64
+MAX_RESIDENT_CHUNKS = 64
+
 #sizes and coordinates relevant for the GUI
 BAR_WIDTH = 20
 PANEL_HEIGHT = 7
@@ -31,7 +52,8 @@ CHARACTER_SCREEN_WIDTH = 30
 #Dungeon Generation
 ROOM_MAX_SIZE = 10
 ROOM_MIN_SIZE = 6
-MAX_ROOMS = 45
+MAX_ROOMS = 45 #rooms tried on a 100 x 100 map, bigger and smaller maps get as many for their area
+ROOM_GRID = 16 #side of the cells rooms are filed under while generating, so a new room is only held against its neighbours
 
 #Spell Variables
 HEAL_AMOUNT = 40
@@ -48,12 +70,70 @@ LEVEL_UP_FACTOR = 150
 LEVEL_SCREEN_WIDTH = 40
 
 #FOV Setup
+FOV_ENGINE = 'libtcod'  #'libtcod' to compute FOV in the C library, 'python' for the shadowcasting in shadowcast.py
 FOV_ALGO = 0  #default FOV algorithm
 FOV_LIGHT_WALLS = True
 TORCH_RADIUS = 10
 
+#Monster pathing: how far (in steps) the shared distance-to-player field reaches
+CHASE_DISTANCE = 2 * TORCH_RADIUS
+
+#Monster perception: how far monsters see by default
+MONSTER_SIGHT_RADIUS = TORCH_RADIUS
+
+#Monster level of detail: monsters further than this from the player are simulated several turns at a time, up to AI_COARSE_TURNS
+AI_DETAIL_RADIUS = CHASE_DISTANCE
+AI_COARSE_TURNS = 10
+
 LIMIT_FPS = 20
 
+#Profiling: F3 shows where the time of a frame goes, F4 starts and stops recording a trace to PROFILE_TRACE_FILE
+#(Chrome trace event format: open it in chrome://tracing or Perfetto)
+PROFILE_TRACE_FILE = 'trace.json'
+PROFILE_TRACE_EVENTS = 500000 #most events a trace keeps; the rest of a longer recording is dropped
+
+#Random numbers: every level seeds its own map and spawn generators from the game seed, so a (seed, depth) pair
+#always generates the same level. the combat/AI generator is seeded once a game (and on loading, from the tick
+#count) and carries on from level to level, so going back to a level doesn't replay its fights
+GAME_SEED = None  #set to a number to replay the same dungeon, None picks a new seed every game
+RNG_MAP = 0
+RNG_SPAWNS = 1
+RNG_COMBAT = 2
+
+#equipment bonuses summed up by Fighter
+EQUIPMENT_BONUSES = ['power_bonus', 'defense_bonus', 'max_hp_bonus', 'max_mp_bonus', 'speed_bonus']
+
+#Save Files
+SAVE_FILE = 'savegame'
+SAVE_MAGIC = b'URFS'
+SAVE_VERSION = 4
+SAVE_COMPRESSIONS = [None, 'zlib', 'lzma']
+SAVE_COMPRESSION = 'zlib'  #one of SAVE_COMPRESSIONS
+#game seed, depth, ticks, ticker order, map width, map height, chunk size, fill of unwritten chunks (one bit per plane),
+#chunks, number of objects, inventory items, player index, stairs index, up stairs index (-1 for none),
+#schedule entries, messages, game state string, dormant levels
+SAVE_HEADER = struct.Struct('<IiiihhhBihhhhhihhh')
+#chunk x, y, followed by its three planes packed into bits
+SAVE_CHUNK = struct.Struct('<hh')
+#x, y, char, name, color r, g, b, flags (blocks, always_visible, fighter, ai, item, equipment, level, ticker), level,
+#fighter: hp, base_max_hp, mp, base_max_mp, base_defense, base_power, base_speed, xp, death_function,
+#ai: ai class, old ai class, confused turns, item: use_function,
+#equipment: slot, is_equipped, power, defense, max_hp, max_mp and speed bonus
+SAVE_ENTITY = struct.Struct('<hhhhBBBBh' 'iiiiiiiih' 'hhh' 'h' 'hBiiiii')
+#depth, length of the encoded level that follows
+SAVE_LEVEL = struct.Struct('<iI')
+#tick, order, entity
+SAVE_SCHEDULE = struct.Struct('<iih')
+#message line string, color r, g, b
+SAVE_MESSAGE = struct.Struct('<hBBB')
+#the only functions and AI classes a save file may refer to by name
+SAVED_FUNCTIONS = ('player_death', 'monster_death', 'cast_heal', 'cast_lightning', 'cast_confuse', 'cast_fireball')
+#translation tables from a 0/1 byte to bit n, and from a packed byte to its bit n
+PACK_BIT_TABLES = [bytes(bytearray([1 << bit if v else 0 for v in range(256)])) for bit in range(8)]
+UNPACK_BIT_TABLES = [bytes(bytearray([(v >> bit) & 1 for v in range(256)])) for bit in range(8)]
+#player turns between autosaves
+AUTOSAVE_TURNS = 20
+
 #character creation
 PLAYABLE_RACES = [
 	{'name':'human','hp':100,'mp':5,'defense':1,'power':2, 'speed':10}, 
@@ -65,34 +145,442 @@ color_light_wall = libtcod.Color(74, 66, 25)
 color_dark_ground = libtcod.Color(102, 94, 46)
 color_light_ground = libtcod.Color(140, 133, 93)
 
-#Set up Font
-libtcod.console_set_custom_font('arial10x10.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+def make_background_tables():
+	#the map colors as byte translation tables, one per channel (red, green, blue), giving the background
+	#of a map cell from its code: visible << 2 | wall << 1 | explored. unexplored cells out of view stay black
+	tables = [bytearray(256), bytearray(256), bytearray(256)]
+	for code in range(8):
+		if code & 4:
+			color = color_light_wall if code & 2 else color_light_ground
+		elif code & 1:
+			color = color_dark_wall if code & 2 else color_dark_ground
+		else:
+			continue
+		for channel in range(3):
+			tables[channel][code] = color[channel]
+	return [bytes(table) for table in tables]
+	
+background_tables = make_background_tables()
+#the same colors as Color objects, indexed by code, for painting single cells
+background_colors = [libtcod.Color(*[bytearray(table)[code] for table in background_tables]) for code in range(8)]
+#translation table giving the new explored flag of a map cell from its code: visible or already explored
+explored_table = bytes(bytearray([1 if code & 5 else 0 for code in range(256)]))
+#translation table turning every byte that isn't 0 into 1
+nonzero_table = bytes(bytearray([1 if code else 0 for code in range(256)]))
+
+def plane_int(plane):
+	#a plane of bytes as one big number, 8 bits per byte, so whole planes of small values can be combined with
+	#shifts and ors at once instead of cell by cell
+	return int(binascii.hexlify(plane), 16)
+	
+def int_plane(value, size):
+	#the plane of size bytes that plane_int turned into value
+	return bytearray(binascii.unhexlify('%0*x' % (2 * size, value)))
+	
+def cell_codes(visible, block_sight, explored):
+	#the background codes (see make_background_tables) of cells from their visible, block sight and explored planes
+	return int_plane(plane_int(visible) << 2 | plane_int(block_sight) << 1 | plane_int(explored), len(visible))
+	
+def changed_cells(old, new, most):
+	#indexes of the cells where two planes differ, or None if there are more than most of them
+	diff = int_plane(plane_int(old) ^ plane_int(new), len(new)).translate(nonzero_table)
+	if diff.count(b'\x01') > most:
+		return None
+	changed = []
+	i = diff.find(b'\x01')
+	while i >= 0:
+		changed.append(i)
+		i = diff.find(b'\x01', i + 1)
+	return changed
+
+#the level pregenerator's worker process imports this module with FIRSTRL_LEVEL_WORKER set: it only makes levels,
+#so it gets no window or consoles
+LEVEL_WORKER = os.environ.get('FIRSTRL_LEVEL_WORKER') == '1'
+
+if not LEVEL_WORKER:
+	#Set up Font
+	libtcod.console_set_custom_font('arial10x10.png', libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+	
+	#Initialize Window
+	libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
+	con = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT)
+	con_scratch = libtcod.console_new(CAMERA_WIDTH, CAMERA_HEIGHT) #con is shifted into this one when the camera scrolls
+	panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
+	libtcod.sys_set_fps(LIMIT_FPS)
+
+#the module the FOV map is made and computed with: both have the same map_* functions
+fov_lib = shadowcast if FOV_ENGINE == 'python' else libtcod
+if fov_lib is shadowcast: shadowcast.precompute(TORCH_RADIUS)
+if fov_lib is libtcod and libtcod.HEADLESS and FOV_ALGO not in libtcod.HEADLESS_FOV_ALGORITHMS:
+	raise ValueError('FOV_ALGO ' + str(FOV_ALGO) + ' is not available in the headless libtcod backend.')
+
+chase_field = None
+
+rng_map = rng_spawns = rng_combat = None
+
+class Autosaver(object):
+	#encodes and writes save snapshots on a worker thread, so the main loop only pays for taking the snapshot
+	def __init__(self):
+		self.pending = None
+		self.busy = False
+		self.error = None
+		self.stopping = False
+		self.thread = None
+		self.condition = threading.Condition()
+		atexit.register(self.stop)
+		
+	def save(self, snapshot):
+		with self.condition:
+			self.pending = snapshot   #a snapshot still waiting to be written is out of date, just replace it
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run)
+				self.thread.daemon = True
+				self.thread.start()
+			self.condition.notify_all()
+			
+	def wait(self):
+		#block until every snapshot handed over so far is on disk
+		with self.condition:
+			while self.pending is not None or self.busy:
+				self.condition.wait()
+				
+	def stop(self):
+		#write out what is still waiting and end the thread, so the interpreter doesn't exit in the middle of a save.
+		#the next save starts a new thread
+		with self.condition:
+			(thread, self.stopping) = (self.thread, True)
+			self.condition.notify_all()
+		if thread is not None:
+			thread.join()
+		with self.condition:
+			(self.thread, self.stopping) = (None, False)
+			
+	def take_error(self):
+		#the error of the last autosave if it failed, once
+		with self.condition:
+			(error, self.error) = (self.error, None)
+		return error
+		
+	def run(self):
+		while True:
+			with self.condition:
+				while self.pending is None and not self.stopping:
+					self.condition.wait()
+				if self.pending is None:
+					return
+				(snapshot, self.pending) = (self.pending, None)
+				self.busy = True
+			try:
+				write_save_file(encode_save(snapshot))
+				self.error = None
+			except Exception as e:
+				self.error = e   #a failed autosave must not take the game down; the next one tries again
+			with self.condition:
+				self.busy = False
+				self.condition.notify_all()
+
+autosaver = Autosaver()
+
+class LevelPregenerator(object):
+	#generates the next depth in a worker process while the player is still on this one
+	def __init__(self):
+		self.pool = None
+		self.pending = None   #((seed, depth), async result)
+		atexit.register(self.close)
+		
+	def request(self, seed, level_depth):
+		if multiprocessing.current_process().daemon:
+			return   #pool workers (see balance.py) can't have a worker of their own; they make levels on the spot
+		if self.pending and self.pending[0] == (seed, level_depth):
+			return
+		if self.pool is None:
+			self.start()
+		self.pending = ((seed, level_depth),
+			self.pool.apply_async(generate_level, (seed, level_depth, (MAP_WIDTH, MAP_HEIGHT, MAX_ROOMS))))
+			
+	def start(self):
+		#start the worker as a fresh process (spawned) where multiprocessing can, so it shares neither the window
+		#nor the threads of this one. python 2 on POSIX can only fork: the copy of the window is never touched there
+		os.environ['FIRSTRL_LEVEL_WORKER'] = '1'
+		try:
+			if hasattr(multiprocessing, 'get_context'):
+				self.pool = multiprocessing.get_context('spawn').Pool(1)
+			else:
+				self.pool = multiprocessing.Pool(1)
+		finally:
+			del os.environ['FIRSTRL_LEVEL_WORKER']
+		
+	def close(self):
+		#stop the worker, letting it finish the level it is on. the next request starts a new one
+		if self.pool is not None:
+			(pool, self.pool, self.pending) = (self.pool, None, None)
+			pool.close()
+			pool.join()
+		
+	def take(self, seed, level_depth):
+		#the encoded level if one was requested, waiting for it if it isn't done yet; None means make it here
+		if not self.pending or self.pending[0] != (seed, level_depth):
+			return None
+		(key, result) = self.pending
+		self.pending = None
+		try:
+			return result.get()
+		except Exception:
+			return None
+
+pregenerator = LevelPregenerator()
+
+class DirtyRegion:
+	#the cells of a console changed since it was last blitted to the screen, kept as one span per row
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.spans = {} # {y: [x1, x2]}, cells x1 <= x < x2 of row y are dirty
+		
+	def mark(self, x, y):
+		span = self.spans.get(y)
+		if span is None:
+			self.spans[y] = [x, x + 1]
+		else:
+			span[0] = min(span[0], x)
+			span[1] = max(span[1], x + 1)
+			
+	def mark_all(self):
+		self.spans = dict((y, [0, self.width]) for y in range(self.height))
+		
+	def blit(self, console, x, y):
+		#copy the dirty cells of the console to (x, y) on the root console, and start over
+		if len(self.spans) > self.height // 2:
+			#most rows changed, one blit of the rectangle around them is cheaper than one per row
+			(top, bottom) = (min(self.spans), max(self.spans) + 1)
+			left = min(x1 for (x1, x2) in self.spans.values())
+			right = max(x2 for (x1, x2) in self.spans.values())
+			libtcod.console_blit(console, left, top, right - left, bottom - top, 0, x + left, y + top)
+		else:
+			for (row, (x1, x2)) in self.spans.items():
+				libtcod.console_blit(console, x1, row, x2 - x1, 1, 0, x + x1, y + row)
+		self.spans = {}
+		
+dirty = DirtyRegion(CAMERA_WIDTH, CAMERA_HEIGHT)
+(camera_x, camera_y) = (0, 0) #top left corner of the part of the map the camera shows
+painted = None #(camera x, camera y, background code of every camera cell) as last painted on con
+
+autopilot = None #when set, answers menus and picks targets instead of the keyboard and mouse (see botsim.py)
 
-#Initialize Window
-libtcod.console_init_root(SCREEN_WIDTH, SCREEN_HEIGHT, 'python/libtcod tutorial', False)
-con = libtcod.console_new(MAP_WIDTH, MAP_HEIGHT)
-panel = libtcod.console_new(SCREEN_WIDTH, PANEL_HEIGHT)
-libtcod.sys_set_fps(LIMIT_FPS)
+#the profiler's clock: the finest one the standard library picks for each platform (time.time only ticks
+#every 15 ms or so on windows)
+profile_clock = timeit.default_timer
+
+class ProfilerPhase(object):
+	#times one phase of a frame for the profiler, as a with block
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+		
+	def __enter__(self):
+		self.start = profile_clock()
+		
+	def __exit__(self, *exc):
+		self.profiler.add(self.name, self.start, profile_clock())
+		
+class NoPhase(object):
+	#what phase() hands out while the profiler is off: a with block that does nothing
+	def __enter__(self):
+		pass
+		
+	def __exit__(self, *exc):
+		pass
+		
+class Profiler(object):
+	#times the phases of each frame of the main loop and every monster turn, for the overlay on the panel and
+	#for trace files. while neither is on, it costs a check of self.enabled here and there
+	def __init__(self):
+		self.enabled = False
+		self.overlay = False
+		self.tracing = False
+		self.events = [] # trace events recorded so far, {'name', 'cat', 'ph', 'ts', 'dur', ...} with times in microseconds
+		self.epoch = profile_clock()
+		self.frame_start = None
+		self.frame = {} # {phase: seconds} of the frame going on
+		self.turns = 0 # monster turns taken in the frame going on
+		self.slowest = (0.0, None) # (seconds, name) of the slowest of those
+		self.last_frame = ({}, 0, (0.0, None)) # (phases, turns, slowest) of the last whole frame
+		self.no_phase = NoPhase()
+		
+	def show_overlay(self, overlay):
+		self.overlay = overlay
+		self.enabled = self.overlay or self.tracing
+		
+	def record(self, tracing):
+		#start recording a trace, or stop and write it to PROFILE_TRACE_FILE
+		if self.tracing and not tracing:
+			self.write_trace(PROFILE_TRACE_FILE)
+			message('Trace written to ' + PROFILE_TRACE_FILE + '.', libtcod.light_gray)
+		elif tracing and not self.tracing:
+			self.events = []
+			message('Recording a trace, press F4 to stop.', libtcod.light_gray)
+		self.tracing = tracing
+		self.enabled = self.overlay or self.tracing
+		
+	def phase(self, name):
+		#a with block timing a phase of the frame
+		if not self.enabled:
+			return self.no_phase
+		return ProfilerPhase(self, name)
+		
+	def add(self, name, start, end):
+		self.frame[name] = self.frame.get(name, 0.0) + end - start
+		if self.tracing and len(self.events) < PROFILE_TRACE_EVENTS:
+			self.events.append({'name': name, 'cat': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1,
+				'ts': (start - self.epoch) * 1000000.0, 'dur': (end - start) * 1000000.0})
+			
+	def next_frame(self):
+		#close the frame going on (if it was being timed) and start timing the next one
+		now = profile_clock()
+		if self.frame_start is not None:
+			self.add('frame', self.frame_start, now)
+			self.last_frame = (self.frame, self.turns, self.slowest)
+		self.frame = {}
+		self.turns = 0
+		self.slowest = (0.0, None)
+		self.frame_start = now if self.enabled else None
+		
+	def turn(self, obj):
+		#let a monster take its turn, timed
+		start = profile_clock()
+		obj.ai.take_turn()
+		end = profile_clock()
+		self.turns += 1
+		if end - start > self.slowest[0]:
+			self.slowest = (end - start, obj.name)
+		if self.tracing and len(self.events) < PROFILE_TRACE_EVENTS:
+			self.events.append({'name': obj.name, 'cat': 'turn', 'ph': 'X', 'pid': 1, 'tid': 1,
+				'ts': (start - self.epoch) * 1000000.0, 'dur': (end - start) * 1000000.0,
+				'args': {'x': obj.x, 'y': obj.y, 'tick': ticker.ticks}})
+				
+	def draw_overlay(self, console, x, y):
+		#the timings of the last frame, in milliseconds, against the frame budget of LIMIT_FPS
+		(phases, turns, (slowest, slowest_name)) = self.last_frame
+		ms = dict((name, 1000.0 * seconds) for (name, seconds) in phases.items())
+		budget = 1000.0 / LIMIT_FPS
+		busy = ms.get('frame', 0.0) - ms.get('flush', 0.0) #flush is where libtcod sleeps to keep to LIMIT_FPS
+		lines = [
+			('frame %.1f ms, busy %.1f of a %.1f ms budget' % (ms.get('frame', 0.0), busy, budget),
+				libtcod.light_red if busy > budget else libtcod.light_green),
+			('render %.1f (fov %.1f)  flush %.1f  events %.1f' % (ms.get('render', 0.0), ms.get('fov', 0.0),
+				ms.get('flush', 0.0), ms.get('events', 0.0)), libtcod.white),
+			('player %.1f  level up %.1f  monsters %.1f (%d turns)' % (ms.get('player', 0.0), ms.get('level up', 0.0),
+				ms.get('monsters', 0.0), turns), libtcod.white),
+			('slowest turn: ' + (slowest_name + ' %.2f ms' % (1000.0 * slowest) if slowest_name else 'none'), libtcod.white),
+			('recording trace: %d events, F4 to stop' % len(self.events) if self.tracing else
+				'F4 to record a trace to ' + PROFILE_TRACE_FILE, libtcod.light_gray)]
+		for (line, color) in lines:
+			libtcod.console_set_default_foreground(console, color)
+			libtcod.console_print_ex(console, x, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+			y += 1
+			
+	def write_trace(self, filename):
+		file = open(filename, 'w')
+		json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, file)
+		file.close()
+		self.events = []
+		
+	def finish(self):
+		#write out a trace still being recorded, however the game ends
+		if self.tracing:
+			self.tracing = False
+			self.enabled = self.overlay
+			self.write_trace(PROFILE_TRACE_FILE)
+		
+profiler = Profiler()
+atexit.register(profiler.finish)
 
 class Ticker(object):
 	#Simple Timer to keep track of turn-taking and implement the idea of speed.
 	def __init__(self):
 		self.ticks = 0 # current ticks--sys.maxint is 2147483647
-		self.schedule = {} # this is the dict of things to do {ticks: [obj1, obj2, ...], ticks+1: [...], ...}
+		self.schedule = [] # heap of things to do [(ticks, order, obj), ...], earliest tick first
+		self.order = 0 # tie-breaker so objects due on the same tick keep the order they were scheduled in
 		
 	def schedule_turn(self, interval, obj):
-		self.schedule.setdefault(self.ticks +interval, []).append(obj)
+		#at least a tick away, or advance would keep handing out turns without time going by
+		heapq.heappush(self.schedule, (self.ticks + max(1, interval), self.order, obj))
+		self.order += 1
 		
 	def next_turn(self):
-		things_to_do = self.schedule.pop(self.ticks, [])
-		for obj in things_to_do:
-			if obj.ai:
-				obj.ai.take_turn()
+		#pop everything due on the current tick as one batch, then let each of them act
+		things_to_do = []
+		while self.schedule and self.schedule[0][0] <= self.ticks:
+			things_to_do.append(heapq.heappop(self.schedule)[2])
+		if profiler.enabled:
+			for obj in things_to_do:
+				if obj.ai:
+					profiler.turn(obj)
+		else:
+			for obj in things_to_do:
+				if obj.ai:
+					obj.ai.take_turn()
 				
+	def advance(self, n_ticks):
+		#let n_ticks pass, jumping straight from one scheduled tick to the next so empty ticks cost nothing
+		end = self.ticks + n_ticks
+		while self.schedule and self.schedule[0][0] <= end:
+			self.ticks = max(self.ticks, self.schedule[0][0])
+			self.next_turn()
+		self.ticks = end
+		
 	def recalculate(self):
-		self.schedule = {}
+		self.schedule = []
 	
 
+class ObjectIndex:
+	#spatial hash of the objects on the map, keyed by (x, y), so per-tile lookups don't scan the whole objects list
+	def __init__(self):
+		self.tiles = {} # {(x, y): [obj1, obj2, ...]}
+		self.blockers = {} # {(x, y): number of blocking objects on that tile}
+		
+	def add(self, obj):
+		self.tiles.setdefault((obj.x, obj.y), []).append(obj)
+		if obj.blocks:
+			self.blockers[(obj.x, obj.y)] = self.blockers.get((obj.x, obj.y), 0) + 1
+			
+	def remove(self, obj):
+		pos = (obj.x, obj.y)
+		here = self.tiles[pos]
+		here.remove(obj)
+		if not here:
+			del self.tiles[pos]
+		if obj.blocks:
+			self.blockers[pos] -= 1
+			if self.blockers[pos] == 0:
+				del self.blockers[pos]
+				
+	def move(self, obj, x, y):
+		#place an indexed object on a new tile
+		self.remove(obj)
+		obj.x = x
+		obj.y = y
+		self.add(obj)
+		
+	def set_blocks(self, obj, blocks):
+		#change whether an indexed object blocks its tile
+		self.remove(obj)
+		obj.blocks = blocks
+		self.add(obj)
+		
+	def at(self, x, y):
+		#all objects on a tile
+		return self.tiles.get((x, y), [])
+		
+	def is_blocked(self, x, y):
+		return (x, y) in self.blockers
+		
+	def rebuild(self, objects):
+		self.tiles = {}
+		self.blockers = {}
+		for obj in objects:
+			self.add(obj)
+
 class Object:
 	#this is a generic object: the player, a monster, an item, the stairs...
 	#it's always represented by a character on the screen.
@@ -125,8 +613,7 @@ class Object:
 	def move(self, dx, dy):
 		#move by the given amount, if not blocked
 		if not is_blocked(self.x + dx, self.y + dy):
-			self.x += dx
-			self.y += dy
+			object_index.move(self, self.x + dx, self.y + dy)
 	
 	def move_towards(self, target_x, target_y):
 		#vector from this object to the target, and distance
@@ -158,12 +645,25 @@ class Object:
 		self.move(dx, dy)
 		
 	def move_random(self):
-		while True:
-			x = libtcod.random_get_int(0, -1, 1)
-			y = libtcod.random_get_int(0, -1, 1)
-			if not is_blocked(self.x + x, self.y + y):
-				self.move(x, y)
+		#step onto a random free tile next to this one, or stay put if there is none
+		free = [(x, y) for x in range(-1, 2) for y in range(-1, 2) if not is_blocked(self.x + x, self.y + y)]
+		if free:
+			self.move(*free[libtcod.random_get_int(rng_combat, 0, len(free) - 1)])
+			
+	def drift(self, turns):
+		#move_random for many turns at once: after n random steps the offset along each axis is roughly
+		#normal with variance 0.75 * n, so draw it (as a sum of uniform draws) and walk there in a straight line
+		spread = math.sqrt(0.75 * turns)
+		(dx, dy) = [int(round(spread * sum(libtcod.random_get_float(rng_combat, -1, 1) for i in range(3)))) for axis in range(2)]
+		(dx, dy) = (max(-turns, min(turns, dx)), max(-turns, min(turns, dy)))
+		(start_x, start_y) = (self.x, self.y)
+		steps = max(abs(dx), abs(dy))
+		for i in range(1, steps + 1):
+			x = start_x + int(round(float(dx) * i / steps))
+			y = start_y + int(round(float(dy) * i / steps))
+			if is_blocked(x, y):
 				break
+			object_index.move(self, x, y)
 		
 	def distance_to(self, other):
 		#return the distance to another object
@@ -176,24 +676,29 @@ class Object:
 		return math.sqrt((x - self.x) ** 2 + (y - self.y) ** 2)
 	
 	def draw(self):
-		if libtcod.map_is_in_fov(fov_map, self.x, self.y) or (self.always_visible and map[self.x][self.y].explored):
+		if in_fov(self.x, self.y) or (self.always_visible and map[self.x][self.y].explored):
 			#if object is in visible range
 			(x, y) = to_camera_coordinates(self.x, self.y)
 			#set the color and then draw the character that represents this object at its position
 			if x is not None:
 				libtcod.console_set_default_foreground(con, self.color)
 				libtcod.console_put_char(con, x, y, self.char, libtcod.BKGND_NONE)
+				dirty.mark(x, y)
 		
 	def clear(self):
 		#erase the character that represents this object
 		(x, y) = to_camera_coordinates(self.x, self.y)
 		if x is not None:
 			libtcod.console_put_char(con, x, y, ' ', libtcod.BKGND_NONE)
+			dirty.mark(x, y)
 		
 	def send_to_back(self):
 		#make this object be drawn first, so all others appear above it if they're in the same tile
 		global objects
-		objects.remove(self)
+		if objects[-1] is self:
+			objects.pop() #just added, as most are: no need to search for it
+		else:
+			objects.remove(self)
 		objects.insert(0, self)
 
 class Fighter:
@@ -208,31 +713,38 @@ class Fighter:
 		self.base_speed = speed
 		self.xp = xp
 		self.death_function = death_function
+		self.equipment_bonuses = None # summed bonuses of everything equipped, None until computed
+		
+	def equipment_bonus(self, stat):
+		#return the bonus for a stat, summed up over all equipped items. the sums are cached until the equipment changes
+		if self.equipment_bonuses is None:
+			equipped = get_all_equipped(self.owner)
+			self.equipment_bonuses = dict((bonus, sum(getattr(equipment, bonus) for equipment in equipped)) for bonus in EQUIPMENT_BONUSES)
+		return self.equipment_bonuses[stat]
+		
+	def equipment_changed(self):
+		#forget the cached bonuses, they get summed up again on the next stat read
+		self.equipment_bonuses = None
 		
 	@property
 	def speed(self):
-		bonus = sum(equipment.speed_bonus for equipment in get_all_equipped(self.owner))
-		return self.base_speed + bonus
+		return self.base_speed + self.equipment_bonus('speed_bonus')
 		
 	@property
 	def power(self):
-		bonus = sum(equipment.power_bonus for equipment in get_all_equipped(self.owner))
-		return self.base_power + bonus
+		return self.base_power + self.equipment_bonus('power_bonus')
 		
 	@property
-	def defense(self):  #return actual defense, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.defense_bonus for equipment in get_all_equipped(self.owner))
-		return self.base_defense + bonus
+	def defense(self):  #return actual defense, including the bonuses from all equipped items
+		return self.base_defense + self.equipment_bonus('defense_bonus')
 		
 	@property
-	def max_hp(self):  #return actual max_hp, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.max_hp_bonus for equipment in get_all_equipped(self.owner))
-		return self.base_max_hp + bonus
+	def max_hp(self):  #return actual max_hp, including the bonuses from all equipped items
+		return self.base_max_hp + self.equipment_bonus('max_hp_bonus')
 		
 	@property
-	def max_mp(self):  #return actual max_mp, by summing up the bonuses from all equipped items
-		bonus = sum(equipment.max_mp_bonus for equipment in get_all_equipped(self.owner))
-		return self.base_max_mp + bonus
+	def max_mp(self):  #return actual max_mp, including the bonuses from all equipped items
+		return self.base_max_mp + self.equipment_bonus('max_mp_bonus')
 		
 	def take_damage(self, damage):
 		#apply damage if possible
@@ -266,19 +778,28 @@ class Fighter:
 			
 class BasicMonster:
 	#AI for a basic monster.
+	def __init__(self, sight_radius=MONSTER_SIGHT_RADIUS):
+		self.sight_radius = sight_radius #how far it sees the player from, 0 for a blind monster
+		
 	def take_turn(self):
-		#a basic monster takes its turn. If you can see it, it can see you
+		#a basic monster takes its turn, chasing the player once it sees them
 		monster = self.owner
-		if libtcod.map_is_in_fov(fov_map, monster.x, monster.y):
+		turns = coarse_turns(monster, max(AI_DETAIL_RADIUS, self.sight_radius))
+		if turns == 1 and can_see(monster.x, monster.y, player.x, player.y, self.sight_radius):
 		
-			#move monster towards player if far away
+			#move monster towards player if far away, following the shared distance field
 			if monster.distance_to(player) >= 2:
-				monster.move_towards(player.x, player.y)
+				step = get_chase_field().step_from(monster.x, monster.y)
+				if step is None:
+					#too far away for the field, just head straight for the player
+					monster.move_towards(player.x, player.y)
+				elif step != (0, 0):
+					monster.move(*step)
 				
 			#close enough, attack! (if the player is still alive)
 			elif player.fighter.hp > 0:
 				monster.fighter.attack(player)
-		self.owner.ticker.schedule_turn(monster.fighter.speed, monster)     # and schedule the next turn
+		self.owner.ticker.schedule_turn(monster.fighter.speed * turns, monster)     # and schedule the next turn
 
 class ConfusedMonster:
 	#AI for a temporarily confused monster.
@@ -290,7 +811,7 @@ class ConfusedMonster:
 		monster = self.owner
 		if self.num_turns > 0: #still confused...
 			#move in a random direction, and decrease the number of turns confused
-			monster.move(libtcod.random_get_int(0, -1, 1), libtcod.random_get_int(0, -1, 1))
+			monster.move(libtcod.random_get_int(rng_combat, -1, 1), libtcod.random_get_int(rng_combat, -1, 1))
 			self.num_turns -= 1
 		else:
 			monster.ai = self.old_ai
@@ -301,9 +822,15 @@ class NeutralCreature:
 	#AI for a purely neutral creature
 	def take_turn(self):
 		npc = self.owner
-		npc.move_random()
-		npc.ticker.schedule_turn(npc.fighter.speed, npc)     # and schedule the next turn
+		turns = coarse_turns(npc)
+		if turns == 1:
+			npc.move_random()
+		else:
+			npc.drift(turns)
+		npc.ticker.schedule_turn(npc.fighter.speed * turns, npc)     # and schedule the next turn
 		
+#AI classes a save file may refer to by name (ConfusedMonster is saved along with the AI it wraps)
+SAVED_AI_CLASSES = {'BasicMonster': BasicMonster, 'NeutralCreature': NeutralCreature}
 			
 class Item:
 	def __init__(self, use_function=None):
@@ -317,12 +844,13 @@ class Item:
 		else:
 			inventory.append(self.owner)
 			objects.remove(self.owner)
+			object_index.remove(self.owner)
 			message('You picked up a ' + self.owner.name + '!', libtcod.green)
-		
-		#special case: automatically equip, if the corresponding equipment slot is unused
-		equipment = self.owner.equipment
-		if equipment and get_equipped_in_slot(equipment.slot) is None:
-			equipment.equip()			
+			
+			#special case: automatically equip, if the corresponding equipment slot is unused
+			equipment = self.owner.equipment
+			if equipment and get_equipped_in_slot(equipment.slot) is None:
+				equipment.equip()
 			
 	def use(self):
 		#special case: if the object has the Equipment component, the "use" action is to equip/dequip
@@ -342,6 +870,7 @@ class Item:
 		inventory.remove(self.owner)
 		self.owner.x = player.x
 		self.owner.y = player.y
+		object_index.add(self.owner)
 		message('You dropped a ' + self.owner.name + '.', libtcod.yellow)
 		if self.owner.equipment:
 			self.owner.equipment.dequip()
@@ -371,23 +900,316 @@ class Equipment:
 			
 		#equip object and show a message about it
 		self.is_equipped = True
+		equipped_slots[self.slot] = self
+		player.fighter.equipment_changed()
 		message('Equipped ' + self.owner.name + ' on ' + self.slot + '.', libtcod.light_green)
 		
 	def dequip(self):
 		#dequip objects and show a message about it
 		if not self.is_equipped: return
 		self.is_equipped = False
+		if equipped_slots.get(self.slot) is self:
+			del equipped_slots[self.slot]
+		player.fighter.equipment_changed()
 		message('Dequipped ' + self.owner.name + ' from ' + self.slot + '.', libtcod.light_yellow)
 		
-class Tile:
-	#a tile of the map and its properties
-	def __init__(self, blocked, explored=False, block_sight = None):
-		self.blocked = blocked
-		self.explored = explored
+class TileMap:
+	#the map, cut into CHUNK_SIZE x CHUNK_SIZE chunks that each keep one flat byte array per tile property,
+	#laid out row by row (index y * CHUNK_SIZE + x inside the chunk), the order libtcod uses for its consoles and FOV maps.
+	#a chunk only gets memory once something is written to it, and only the MAX_RESIDENT_CHUNKS most recently used
+	#chunks stay in memory: the others are swapped out to a temporary file until they are needed again
+	BLOCKED = 0
+	BLOCK_SIGHT = 1
+	EXPLORED = 2
+	PLANES = ('blocked', 'block_sight', 'explored')
+	OUTSIDE = (1, 1, 0) #what tiles outside the map read as
+	INVERT = bytes(bytearray([1] + [0] * 255)) #translation table turning 0 into 1 and everything else into 0
+	
+	def __init__(self, width, height, blocked=True, explored=False):
+		self.width = width
+		self.height = height
+		self.fill = (int(blocked), int(blocked), int(explored)) #every tile of a chunk nothing was written to yet
+		self.resident = {} # {(cx, cy): [blocked, block_sight, explored]}
+		self.used = {} # {(cx, cy): when it was last looked up}, to find the least recently used one
+		self.uses = 0
+		self.swapped = {} # {(cx, cy): (offset, length) of its compressed planes in the swap file}
+		self.swap_file = None
+		(self.last_key, self.last_planes) = (None, None)
+		self.on_change = None #called with (x1, y1, x2, y2) when tiles in that rectangle change whether they block
 		
+	def __getitem__(self, x):
+		#compatibility view, so that map[x][y].blocked and friends keep working
+		return TileColumn(self, x)
+		
+	def chunk(self, cx, cy, create=False):
+		#the planes of a chunk, swapped back in if needed. None for a chunk nothing was written to, unless create is set
+		key = (cx, cy)
+		if key == self.last_key:
+			return self.last_planes
+		self.uses += 1
+		planes = self.resident.get(key)
+		if planes is None:
+			if key in self.swapped:
+				planes = self.read_swapped(key)
+			elif create:
+				planes = [bytearray([value]) * (CHUNK_SIZE * CHUNK_SIZE) for value in self.fill]
+			else:
+				return None
+			self.resident[key] = planes
+			self.used[key] = self.uses
+			while len(self.resident) > MAX_RESIDENT_CHUNKS:
+				self.swap_out()
+		else:
+			self.used[key] = self.uses
+		(self.last_key, self.last_planes) = (key, planes)
+		return planes
+		
+	def swap_out(self):
+		#write the least recently used chunk to the swap file and forget it
+		key = min(self.used, key=self.used.get)
+		planes = self.resident.pop(key)
+		del self.used[key]
+		if key == self.last_key:
+			(self.last_key, self.last_planes) = (None, None)
+		data = zlib.compress(b''.join(bytes(plane) for plane in planes), 1)
+		if self.swap_file is None:
+			self.swap_file = tempfile.TemporaryFile()
+		(offset, length) = self.swapped.get(key, (None, 0))
+		if offset is None or len(data) > length:
+			#doesn't fit where it was last time, append it
+			self.swap_file.seek(0, 2)
+			offset = self.swap_file.tell()
+		else:
+			self.swap_file.seek(offset)
+		self.swap_file.write(data)
+		self.swapped[key] = (offset, len(data))
+		
+	def read_swapped(self, key):
+		return TileMap.unswap(self.swapped_data(key))
+		
+	def swapped_data(self, key):
+		#the planes of a swapped out chunk, compressed as they are in the swap file
+		(offset, length) = self.swapped[key]
+		self.swap_file.seek(offset)
+		return self.swap_file.read(length)
+		
+	@staticmethod
+	def unswap(data):
+		#the planes of a chunk from what swapped_data returned
+		data = zlib.decompress(data)
+		size = CHUNK_SIZE * CHUNK_SIZE
+		return [bytearray(data[i * size:(i + 1) * size]) for i in range(3)]
+		
+	def chunks(self):
+		#(cx, cy, planes) of every chunk in memory, without disturbing which ones are resident
+		for (key, planes) in sorted(self.resident.items()):
+			yield key + (planes,)
+			
+	def swapped_chunks(self):
+		#(cx, cy, compressed planes) of every chunk swapped out, for saving them without swapping them in
+		for key in sorted(self.swapped):
+			if key not in self.resident:
+				yield key + (self.swapped_data(key),)
+				
+	def get(self, plane, x, y):
+		if x < 0 or y < 0 or x >= self.width or y >= self.height:
+			return TileMap.OUTSIDE[plane]
+		planes = self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)
+		if planes is None:
+			return self.fill[plane]
+		return planes[plane][(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+		
+	def set(self, plane, x, y, value):
+		planes = self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE, create=True)
+		i = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+		if planes[plane][i] != value:
+			planes[plane][i] = value
+			if plane != TileMap.EXPLORED: self.changed(x, y, x + 1, y + 1)
+			
+	def changed(self, x1, y1, x2, y2):
+		if self.on_change: self.on_change(x1, y1, x2, y2)
+		
+	def is_blocked(self, x, y):
+		return self.get(TileMap.BLOCKED, x, y)
+		
+	def row(self, plane, x, y, w):
+		#w tiles of a plane from (x, y) to the right, a slice of each chunk the row crosses
+		if y < 0 or y >= self.height:
+			return bytearray([TileMap.OUTSIDE[plane]]) * w
+		row = bytearray()
+		if x < 0:
+			row += bytearray([TileMap.OUTSIDE[plane]]) * min(-x, w)
+			(x, w) = (0, w + x)
+		start = (y % CHUNK_SIZE) * CHUNK_SIZE
+		while w > 0 and x < self.width:
+			n = min(w, CHUNK_SIZE - x % CHUNK_SIZE, self.width - x)
+			planes = self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE)
+			if planes is None:
+				row += bytearray([self.fill[plane]]) * n
+			else:
+				row += planes[plane][start + x % CHUNK_SIZE:start + x % CHUNK_SIZE + n]
+			(x, w) = (x + n, w - n)
+		if w > 0:
+			row += bytearray([TileMap.OUTSIDE[plane]]) * w
+		return row
+		
+	def set_row(self, plane, x, y, values):
+		#write a row of tiles from (x, y) to the right
+		self.write_row(plane, x, y, values)
+		if plane != TileMap.EXPLORED: self.changed(x, y, x + len(values), y + 1)
+		
+	def write_row(self, plane, x, y, values):
+		#set_row without telling on_change. only chunks that end up different from their fill get memory
+		start = (y % CHUNK_SIZE) * CHUNK_SIZE
+		i = 0
+		while i < len(values):
+			n = min(len(values) - i, CHUNK_SIZE - x % CHUNK_SIZE)
+			part = values[i:i + n]
+			planes = self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE, create=part != bytearray([self.fill[plane]]) * n)
+			if planes is not None:
+				planes[plane][start + x % CHUNK_SIZE:start + x % CHUNK_SIZE + n] = part
+			(x, i) = (x + n, i + n)
+			
+	def region(self, plane, x, y, w, h):
+		#a w x h rectangle of a plane, row by row, tiles outside the map included (see OUTSIDE)
+		region = bytearray()
+		for row_y in range(y, y + h):
+			region += self.row(plane, x, row_y, w)
+		return region
+		
+	def set_region(self, plane, x, y, w, values):
+		#write a rectangle of a plane w tiles wide, row by row like region returns them
+		for i in range(0, len(values), w):
+			self.set_row(plane, x, y + i // w, values[i:i + w])
+			
+	def transparent(self, x, y, w, h):
+		#one byte per tile of the rectangle, 1 where light goes through
+		return self.region(TileMap.BLOCK_SIGHT, x, y, w, h).translate(TileMap.INVERT)
+		
+	def walkable(self, x, y, w, h):
+		#one byte per tile of the rectangle, 1 where the tile can be walked on
+		return self.region(TileMap.BLOCKED, x, y, w, h).translate(TileMap.INVERT)
+		
+	def set_rect(self, x1, y1, x2, y2, blocked, block_sight=None):
+		#set the tiles with x1 <= x < x2 and y1 <= y < y2, one row slice at a time
 		#by default, if a tile is blocked, it also blocks sight
 		if block_sight is None: block_sight = blocked
-		self.block_sight = block_sight
+		w = x2 - x1
+		if w <= 0: return
+		if w < y2 - y1:
+			#taller than wide, like a vertical tunnel: a column at a time
+			for x in range(x1, x2):
+				self.write_column(TileMap.BLOCKED, x, y1, y2, blocked)
+				self.write_column(TileMap.BLOCK_SIGHT, x, y1, y2, block_sight)
+		else:
+			blocked_row = bytearray([blocked]) * w
+			block_sight_row = bytearray([block_sight]) * w
+			for y in range(y1, y2):
+				self.write_row(TileMap.BLOCKED, x1, y, blocked_row)
+				self.write_row(TileMap.BLOCK_SIGHT, x1, y, block_sight_row)
+		self.changed(x1, y1, x2, y2)
+		
+	def write_column(self, plane, x, y1, y2, value):
+		#set the tiles from (x, y1) down to (x, y2 - 1) to value, a strided slice of each chunk the column crosses.
+		#like write_row, doesn't tell on_change
+		y = y1
+		while y < y2:
+			n = min(y2 - y, CHUNK_SIZE - y % CHUNK_SIZE)
+			planes = self.chunk(x // CHUNK_SIZE, y // CHUNK_SIZE, create=value != self.fill[plane])
+			if planes is not None:
+				start = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+				planes[plane][start:start + n * CHUNK_SIZE:CHUNK_SIZE] = bytearray([value]) * n
+			y += n
+			
+	def carve(self, x1, y1, x2, y2):
+		#make the tiles with x1 <= x < x2 and y1 <= y < y2 passable and see-through
+		self.set_rect(x1, y1, x2, y2, False)
+		
+class TileColumn(object):
+	#one column of a TileMap, returned by map[x]
+	def __init__(self, tiles, x):
+		self.tiles = tiles
+		self.x = x
+		
+	def __getitem__(self, y):
+		return Tile(self.tiles, self.x, y)
+		
+class Tile(object):
+	#a tile of the map and its properties, read and written through to the TileMap it belongs to
+	def __init__(self, tiles, x, y):
+		self.tiles = tiles
+		self.x = x
+		self.y = y
+		
+	@property
+	def blocked(self):
+		return bool(self.tiles.get(TileMap.BLOCKED, self.x, self.y))
+		
+	@blocked.setter
+	def blocked(self, value):
+		self.tiles.set(TileMap.BLOCKED, self.x, self.y, bool(value))
+		
+	@property
+	def block_sight(self):
+		return bool(self.tiles.get(TileMap.BLOCK_SIGHT, self.x, self.y))
+		
+	@block_sight.setter
+	def block_sight(self, value):
+		self.tiles.set(TileMap.BLOCK_SIGHT, self.x, self.y, bool(value))
+		
+	@property
+	def explored(self):
+		return bool(self.tiles.get(TileMap.EXPLORED, self.x, self.y))
+		
+	@explored.setter
+	def explored(self, value):
+		self.tiles.set(TileMap.EXPLORED, self.x, self.y, bool(value))
+		
+class DistanceField:
+	#number of steps from one tile to every walkable tile around it, flooded out once and then
+	#shared by everything heading for that tile. only the square of tiles the flood can reach is read from the map
+	def __init__(self, tiles, x, y, max_distance):
+		self.tiles = tiles
+		self.x = x
+		self.y = y
+		#the square reaches one tile past max_distance, so the flood never wraps around its edges
+		r = max_distance + 1
+		(self.left, self.top, self.size) = (x - r, y - r, 2 * r + 1)
+		w = self.size
+		#(index offset, dx, dy) of the 8 neighbours of a tile
+		self.neighbours = [(dy * w + dx, dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dx or dy]
+		offsets = [n for (n, dx, dy) in self.neighbours]
+		
+		start = r * w + r
+		distance = {start: 0}
+		frontier = deque([start])
+		blocked = tiles.region(TileMap.BLOCKED, self.left, self.top, w, w)
+		while frontier:
+			i = frontier.popleft()
+			d = distance[i] + 1
+			if d > max_distance: break
+			for n in offsets:
+				n += i
+				if n not in distance and not blocked[n]:
+					distance[n] = d
+					frontier.append(n)
+		self.distance = distance
+		
+	def step_from(self, x, y):
+		#return the (dx, dy) step to the free neighbour closest to the origin: (0, 0) if none of the closer ones
+		#is free right now, None if the field doesn't reach (x, y)
+		(fx, fy) = (x - self.left, y - self.top)
+		if fx < 0 or fy < 0 or fx >= self.size or fy >= self.size: return None
+		i = fy * self.size + fx
+		best = self.distance.get(i)
+		if best is None: return None
+		step = (0, 0)
+		for (n, dx, dy) in self.neighbours:
+			d = self.distance.get(i + n)
+			if d is not None and d < best and not is_blocked(x + dx, y + dy):
+				best = d
+				step = (dx, dy)
+		return step
 		
 class Rect:
 	#a rectangle on the map. Used to characterize a room
@@ -405,19 +1227,29 @@ class Rect:
 	def intersect(self, other):
 		#returns true if this rectangle intersects with another one
 		return (self.x1 <= other.x2 and self.x2 > other.x1 and self.y1 <= other.y2 and self.y2 >= other.y1)
+		
+	def grid_cells(self):
+		#the ROOM_GRID cells this rectangle touches, borders included: rectangles that intersect share one
+		return [(gx, gy) for gx in range(self.x1 // ROOM_GRID, self.x2 // ROOM_GRID + 1)
+			for gy in range(self.y1 // ROOM_GRID, self.y2 // ROOM_GRID + 1)]
 
 def new_game():
-	global player, inventory, game_msgs, game_state, depth, ticker
+	global player, inventory, equipped_slots, game_msgs, game_state, depth, ticker, game_seed, dormant_levels
 	
 	ticker = Ticker()
+	game_seed = GAME_SEED & 0xffffffff if GAME_SEED is not None else libtcod.random_get_int(0, 0, 0x7fffffff) #saved as 32 bits
+	seed_combat_stream()
+	dormant_levels = {} # {depth: the level, frozen with encode_save}
 	
 	#Have the Player Choose his race
 	options = []
 	for race in PLAYABLE_RACES:
 			text = race['name']
 			options.append(text)
-	player_race = menu('Choose Race:', options, 50)
-	player_race = PLAYABLE_RACES[libtcod.console_wait_for_keypress(True).c - ord('a')]
+	choice = None
+	while choice == None: #keep asking until choice is made
+		choice = menu('Choose Race:', options, 50)
+	player_race = PLAYABLE_RACES[choice]
 	
 	#create the object representing the player
 	fighter_component = Fighter(hp=player_race['hp'], mp=player_race['mp'], defense=player_race['defense'], power=player_race['power'], speed=player_race['speed'], xp=0, death_function = player_death)
@@ -434,6 +1266,7 @@ def new_game():
 	#Initialize Game States and Player Inventory
 	game_state = 'playing'
 	inventory = []
+	equipped_slots = {} # {slot: equipment}, what the player is wearing
 	
 	#create list of game messages and their colors. starts empty
 	game_msgs = []
@@ -453,82 +1286,423 @@ def play_game():
 	global camera_x, camera_y, key, mouse, ticker
 	
 	player_action = None
+	turns_since_save = 0
 	mouse = libtcod.Mouse()
 	key = libtcod.Key()
 	
 	(camera_x, camera_y) = (0,0)
 	
+	pregenerate_next_level()
+	
 	#Start Main Loop
 	while not libtcod.console_is_window_closed():
-	
-		libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE,key,mouse)
+		profiler.next_frame()
+		
+		with profiler.phase('events'):
+			libtcod.sys_check_for_event(libtcod.EVENT_KEY_PRESS|libtcod.EVENT_MOUSE,key,mouse)
 	
 		#render all objects in list
-		render_all()
+		with profiler.phase('render'):
+			render_all()
 	
 		#Present the changes (flush) to the screen
-		libtcod.console_flush()
+		with profiler.phase('flush'):
+			libtcod.console_flush()
 		
 		#check for level up
-		check_level_up()
+		with profiler.phase('level up'):
+			check_level_up()
 	
 		#erase all objects at their old locations, before they move
 		for object in objects:
 			object.clear()
 	
 		#handle keys and exit game if needed
-		player_action = handle_keys()
+		with profiler.phase('player'):
+			player_action = handle_keys()
 		if player_action == 'exit':
 			save_game()
 			break
 
 		#let monsters take their turn
 		if game_state == 'playing' and player_action != 'didnt-take-turn':
-			for x in range(0, player.fighter.speed):
-				ticker.ticks += 1
-				ticker.next_turn()
+			with profiler.phase('monsters'):
+				ticker.advance(player.fighter.speed)
+			
+			turns_since_save += 1
+			if turns_since_save >= AUTOSAVE_TURNS:
+				autosaver.save(snapshot_game())
+				turns_since_save = 0
+				
+		#an autosave that failed is reported once it is known, the next one tries again
+		error = autosaver.take_error()
+		if error:
+			message('Autosave failed: ' + str(error), libtcod.red)
+			
+	#back to the main menu (or the window was closed): stop recording a trace, let the last autosave finish,
+	#and whatever the worker is making is of no use to the next game
+	profiler.record(False)
+	autosaver.stop()
+	pregenerator.close()
 
 def save_game():
-	#open a new empty shelve (possibly overwriting an old one) to write the game data
-	file = shelve.open('savegame', 'n')
-	file['map'] = map
-	file['objects'] = objects
-	file['player_index'] = objects.index(player) #index of player in objects list
-	file['inventory'] = inventory
-	file['game_msgs'] = game_msgs
-	file['game_state'] = game_state
-	file['stairs_index'] = objects.index(stairs)
-	file['depth'] = depth
-	file.close()
+	#write a snapshot of the game to the save file, waiting for it (and any autosave still in flight) to finish
+	autosaver.save(snapshot_game())
+	autosaver.wait()
+	if autosaver.error:
+		raise autosaver.error
 
 def load_game():
-	#open the previously saved shelve and load the game data
-	global map, objects, player, inventory, game_msgs, game_state, stairs
-	global depth
+	#read the save file back and rebuild the game from it
+	global map, objects, player, inventory, equipped_slots, game_msgs, game_state, stairs, upstairs
+	global depth, object_index, ticker, game_seed, dormant_levels
 	
-	file = shelve.open('savegame', 'r')
-	map = file['map']
-	objects = file['objects']
-	player = objects[file['player_index']] #get index of player in objects list and access it
-	inventory = file['inventory']
-	game_msgs = file['game_msgs']
-	game_state = file['game_state']
-	stairs = objects[file['stairs_index']]
-	depth = file['depth']
+	file = open(SAVE_FILE, 'rb')
+	data = file.read()
 	file.close()
+	save = decode_save(data)
+	
+	game_seed = save['game_seed']
+	depth = save['depth']
+	game_state = save['game_state']
+	game_msgs = save['game_msgs']
+	ticker = save['ticker']
+	seed_combat_stream()
+	map = save['map']
+	objects = save['objects']
+	inventory = save['inventory']
+	player = objects[save['player_index']]
+	stairs = objects[save['stairs_index']]
+	upstairs = objects[save['upstairs_index']] if save['upstairs_index'] >= 0 else None
+	dormant_levels = save['levels']
+	
+	object_index = ObjectIndex()
+	object_index.rebuild(objects)
+	
+	#rebuild the equipment caches from the saved inventory
+	equipped_slots = {}
+	for obj in inventory:
+		if obj.equipment and obj.equipment.is_equipped:
+			equipped_slots[obj.equipment.slot] = obj.equipment
 	
 	initialize_fov()
 	
+def write_save_file(data):
+	#write a temporary file, fsync it and rename it over the old save, so a crash never leaves half a save behind
+	temp_file = SAVE_FILE + '.tmp'
+	file = open(temp_file, 'wb')
+	try:
+		file.write(data)
+		file.flush()
+		os.fsync(file.fileno())
+	finally:
+		file.close()
+	if os.name == 'nt' and os.path.exists(SAVE_FILE):
+		os.remove(SAVE_FILE)   #rename doesn't replace an existing file on Windows
+	os.rename(temp_file, SAVE_FILE)
+	if hasattr(os, 'O_DIRECTORY'):
+		#make the rename itself durable
+		dir_fd = os.open(os.path.dirname(os.path.abspath(SAVE_FILE)), os.O_RDONLY | os.O_DIRECTORY)
+		try:
+			os.fsync(dir_fd)
+		finally:
+			os.close(dir_fd)
+	
+def snapshot_game(level_only=False):
+	#copy everything a save needs into plain tuples and strings, so it can be encoded later without touching the game
+	#(level_only leaves out the inventory, messages and dormant levels, for freezing just the current level)
+	(carried, messages, levels) = ([], [], []) if level_only else (inventory, game_msgs, sorted(dormant_levels.items()))
+	strings = StringTable()
+	entities = objects + carried
+	entity_ids = dict((id(obj), i) for (i, obj) in enumerate(entities))
+	chunks = [(cx, cy, [bytes(plane) for plane in planes]) for (cx, cy, planes) in map.chunks()]
+	#swapped out chunks are copied compressed, encode_save (on the autosave thread) unpacks them
+	swapped_chunks = list(map.swapped_chunks())
+	fill = map.fill[0] | map.fill[1] << 1 | map.fill[2] << 2
+	return {
+		'strings': strings,
+		'header': (game_seed, depth, ticker.ticks, ticker.order, map.width, map.height, CHUNK_SIZE, fill,
+			len(chunks) + len(swapped_chunks),
+			len(objects), len(carried), objects.index(player), objects.index(stairs), objects.index(upstairs) if upstairs else -1,
+			len(ticker.schedule), len(messages), strings.add(game_state), len(levels)),
+		'chunks': chunks,
+		'swapped_chunks': swapped_chunks,
+		'entities': [entity_row(obj, strings) for obj in entities],
+		'schedule': [(tick, order, entity_ids[id(obj)]) for (tick, order, obj) in ticker.schedule if id(obj) in entity_ids],
+		'messages': [(strings.add(line), color.r, color.g, color.b) for (line, color) in messages],
+		'levels': levels}
+		
+def entity_row(obj, strings):
+	#one row of the entity table, see SAVE_ENTITY
+	flags = 0
+	for (bit, present) in enumerate((obj.blocks, obj.always_visible, obj.fighter, obj.ai, obj.item, obj.equipment,
+			hasattr(obj, 'level'), getattr(obj, 'ticker', None))):
+		if present: flags |= 1 << bit
+	row = [obj.x, obj.y, strings.add(obj.char), strings.add(obj.name), obj.color.r, obj.color.g, obj.color.b, flags,
+		getattr(obj, 'level', 0)]
+	
+	fighter = obj.fighter
+	if fighter:
+		row += [fighter.hp, fighter.base_max_hp, fighter.mp, fighter.base_max_mp, fighter.base_defense,
+			fighter.base_power, fighter.base_speed, fighter.xp, strings.add_function(fighter.death_function)]
+	else:
+		row += [0, 0, 0, 0, 0, 0, 0, 0, -1]
+		
+	ai = obj.ai
+	if isinstance(ai, ConfusedMonster):
+		#a monster confused twice is saved as confused once, by the AI it will go back to
+		old_ai = ai.old_ai
+		while isinstance(old_ai, ConfusedMonster):
+			old_ai = old_ai.old_ai
+		row += [strings.add('ConfusedMonster'), strings.add(old_ai.__class__.__name__), ai.num_turns]
+	elif ai:
+		row += [strings.add(ai.__class__.__name__), -1, 0]
+	else:
+		row += [-1, -1, 0]
+		
+	row.append(strings.add_function(obj.item.use_function) if obj.item else -1)
+	
+	equipment = obj.equipment
+	if equipment:
+		row += [strings.add(equipment.slot), equipment.is_equipped] + [getattr(equipment, bonus) for bonus in EQUIPMENT_BONUSES]
+	else:
+		row += [-1, 0, 0, 0, 0, 0, 0]
+	return row
+	
+def encode_save(snapshot):
+	#turn a snapshot into the bytes of a save file: magic, version, compression, then the (compressed) payload
+	strings = snapshot['strings'].strings
+	parts = [SAVE_HEADER.pack(*snapshot['header']), struct.pack('<H', len(strings))]
+	for s in strings:
+		if not isinstance(s, bytes): s = s.encode('utf-8')
+		parts.append(struct.pack('<H', len(s)))
+		parts.append(s)
+	chunks = snapshot['chunks'] + [(cx, cy, TileMap.unswap(data)) for (cx, cy, data) in snapshot['swapped_chunks']]
+	for (cx, cy, planes) in chunks:
+		parts.append(SAVE_CHUNK.pack(cx, cy))
+		parts += [bytes(pack_bits(bytearray(plane))) for plane in planes]
+	parts += [SAVE_ENTITY.pack(*row) for row in snapshot['entities']]
+	parts += [SAVE_SCHEDULE.pack(*entry) for entry in snapshot['schedule']]
+	parts += [SAVE_MESSAGE.pack(*message) for message in snapshot['messages']]
+	for (level_depth, level) in snapshot['levels']:
+		parts += [SAVE_LEVEL.pack(level_depth, len(level)), level]
+	payload = b''.join(parts)
+	
+	if SAVE_COMPRESSION == 'zlib':
+		payload = zlib.compress(payload, 6)
+	elif SAVE_COMPRESSION == 'lzma':
+		payload = lzma.compress(payload)
+	return SAVE_MAGIC + struct.pack('<HB', SAVE_VERSION, SAVE_COMPRESSIONS.index(SAVE_COMPRESSION)) + payload
+	
+def decode_save(data):
+	#read the bytes of a save file back into fresh game objects
+	if data[:4] != SAVE_MAGIC:
+		raise ValueError('Not a save file.')
+	(version, compression) = struct.unpack_from('<HB', data, 4)
+	if version != SAVE_VERSION:
+		raise ValueError('Unsupported save file version ' + str(version) + '.')
+	payload = data[7:]
+	if SAVE_COMPRESSIONS[compression] == 'zlib':
+		payload = zlib.decompress(payload)
+	elif SAVE_COMPRESSIONS[compression] == 'lzma':
+		if lzma is None: raise ValueError('This Python cannot read lzma compressed saves.')
+		payload = lzma.decompress(payload)
+		
+	(seed, save_depth, ticks, order, width, height, chunk_size, fill, n_chunks, n_objects, n_inventory, player_index,
+		stairs_index, upstairs_index, n_schedule, n_messages, game_state_string, n_levels) = SAVE_HEADER.unpack_from(payload, 0)
+	if chunk_size != CHUNK_SIZE:
+		raise ValueError('Save file uses a chunk size of ' + str(chunk_size) + '.')
+	offset = SAVE_HEADER.size
+	
+	(n_strings,) = struct.unpack_from('<H', payload, offset)
+	offset += 2
+	strings = []
+	for i in range(n_strings):
+		(length,) = struct.unpack_from('<H', payload, offset)
+		s = payload[offset + 2:offset + 2 + length]
+		strings.append(s if str is bytes else s.decode('utf-8'))
+		offset += 2 + length
+		
+	tiles = TileMap(width, height)
+	tiles.fill = (fill & 1, fill >> 1 & 1, fill >> 2 & 1)
+	plane_bytes = CHUNK_SIZE * CHUNK_SIZE // 8
+	for i in range(n_chunks):
+		(cx, cy) = SAVE_CHUNK.unpack_from(payload, offset)
+		offset += SAVE_CHUNK.size
+		planes = tiles.chunk(cx, cy, create=True)
+		for plane in range(3):
+			planes[plane] = unpack_bits(bytearray(payload[offset:offset + plane_bytes]), CHUNK_SIZE * CHUNK_SIZE)
+			offset += plane_bytes
+		
+	save_ticker = Ticker()
+	save_ticker.ticks = ticks
+	save_ticker.order = order
+	entities = []
+	for i in range(n_objects + n_inventory):
+		entities.append(entity_from_row(SAVE_ENTITY.unpack_from(payload, offset), strings, save_ticker))
+		offset += SAVE_ENTITY.size
+		
+	for i in range(n_schedule):
+		(tick, tick_order, entity) = SAVE_SCHEDULE.unpack_from(payload, offset)
+		save_ticker.schedule.append((tick, tick_order, entities[entity]))
+		offset += SAVE_SCHEDULE.size
+	heapq.heapify(save_ticker.schedule)
+	
+	messages = []
+	for i in range(n_messages):
+		(line, r, g, b) = SAVE_MESSAGE.unpack_from(payload, offset)
+		messages.append((strings[line], libtcod.Color(r, g, b)))
+		offset += SAVE_MESSAGE.size
+		
+	levels = {}
+	for i in range(n_levels):
+		(level_depth, length) = SAVE_LEVEL.unpack_from(payload, offset)
+		offset += SAVE_LEVEL.size
+		levels[level_depth] = bytes(payload[offset:offset + length])
+		offset += length
+		
+	return {'game_seed': seed, 'depth': save_depth, 'game_state': strings[game_state_string], 'game_msgs': messages, 'ticker': save_ticker,
+		'map': tiles, 'objects': entities[:n_objects], 'inventory': entities[n_objects:],
+		'player_index': player_index, 'stairs_index': stairs_index, 'upstairs_index': upstairs_index, 'levels': levels}
+		
+def entity_from_row(row, strings, save_ticker):
+	(x, y, char, name, r, g, b, flags, level,
+		hp, base_max_hp, mp, base_max_mp, base_defense, base_power, base_speed, xp, death_function,
+		ai_name, old_ai_name, num_turns, use_function,
+		slot, is_equipped, power_bonus, defense_bonus, max_hp_bonus, max_mp_bonus, speed_bonus) = row
+		
+	fighter = None
+	if flags & 4:
+		fighter = Fighter(hp=hp, defense=base_defense, power=base_power, xp=xp, speed=base_speed, mp=mp,
+			death_function=saved_function(strings, death_function))
+		fighter.base_max_hp = base_max_hp
+		fighter.base_max_mp = base_max_mp
+	item = None
+	if flags & 16 and not flags & 32:
+		item = Item(use_function=saved_function(strings, use_function))
+	equipment = None
+	if flags & 32:
+		equipment = Equipment(strings[slot], power_bonus=power_bonus, defense_bonus=defense_bonus,
+			max_hp_bonus=max_hp_bonus, max_mp_bonus=max_mp_bonus, speed_bonus=speed_bonus)
+		equipment.is_equipped = bool(is_equipped)
+		
+	#the AI is attached afterwards, so that creating the object doesn't schedule a turn the saved schedule already has
+	obj = Object(x, y, strings[char], strings[name], libtcod.Color(r, g, b), blocks=bool(flags & 1),
+		always_visible=bool(flags & 2), fighter=fighter, item=item, equipment=equipment)
+	if flags & 8:
+		if strings[ai_name] == 'ConfusedMonster':
+			obj.ai = ConfusedMonster(SAVED_AI_CLASSES[strings[old_ai_name]](), num_turns)
+			obj.ai.old_ai.owner = obj
+		else:
+			obj.ai = SAVED_AI_CLASSES[strings[ai_name]]()
+		obj.ai.owner = obj
+	if flags & 64:
+		obj.level = level
+	if flags & 128:
+		obj.ticker = save_ticker
+	return obj
+	
+def saved_function(strings, index):
+	#look up a death or use function saved by name
+	if index < 0: return None
+	name = strings[index]
+	if name not in SAVED_FUNCTIONS:
+		raise ValueError('Unknown function ' + name + ' in save file.')
+	return globals()[name]
+	
+class StringTable:
+	#the strings of a save file, each stored once and referred to by index
+	def __init__(self):
+		self.strings = []
+		self.indexes = {}
+		
+	def add(self, s):
+		if s not in self.indexes:
+			self.indexes[s] = len(self.strings)
+			self.strings.append(s)
+		return self.indexes[s]
+		
+	def add_function(self, function):
+		if function is None: return -1
+		return self.add(function.__name__)
+		
+def pack_bits(plane):
+	#pack a plane of 0/1 bytes 8 cells to a byte, cell i going to bit i % 8 of byte i // 8
+	plane = plane + bytearray(-len(plane) % 8)
+	columns = [plane[bit::8].translate(PACK_BIT_TABLES[bit]) for bit in range(8)]
+	return bytearray([b0 | b1 | b2 | b3 | b4 | b5 | b6 | b7 for (b0, b1, b2, b3, b4, b5, b6, b7) in zip(*columns)])
+	
+def unpack_bits(packed, size):
+	plane = bytearray(len(packed) * 8)
+	for bit in range(8):
+		plane[bit::8] = packed.translate(UNPACK_BIT_TABLES[bit])
+	return plane[:size]
+	
 def initialize_fov():
-	global fov_recompute, fov_map
+	global fov_recompute, fov_map, fov_window, painted
 	fov_recompute = True
 	libtcod.console_clear(con)
+	painted = None
+	dirty.mark_all()
+	
+	#create the FOV map. it only covers the part of the map the camera shows, and is filled in by render_all
+	fov_map = fov_lib.map_new(CAMERA_WIDTH, CAMERA_HEIGHT)
+	fov_window = None
+	map.on_change = tiles_changed
+	
+def tiles_changed(x1, y1, x2, y2):
+	#the map tells us tiles with x1 <= x < x2 and y1 <= y < y2 changed whether they block: copy just those
+	#into the FOV map, and only see again if they are close enough to the player to matter
+	global fov_recompute, fov_window, chase_field
+	chase_field = None
+	
+	if fov_window is not None and fov_window[0] is map:
+		(left, top) = (fov_window[1], fov_window[2])
+		(cx1, cy1, cx2, cy2) = (max(x1, left), max(y1, top), min(x2, left + CAMERA_WIDTH), min(y2, top + CAMERA_HEIGHT))
+		if cx1 >= cx2 or cy1 >= cy2:
+			pass #nothing the FOV map covers
+		elif (cx2 - cx1) * (cy2 - cy1) > CAMERA_WIDTH * CAMERA_HEIGHT // 4:
+			fov_window = None #a change this big is cheaper to refill in bulk
+		else:
+			for y in range(cy1, cy2):
+				for x in range(cx1, cx2):
+					fov_lib.map_set_properties(fov_map, x - left, y - top, not map.get(TileMap.BLOCK_SIGHT, x, y),
+						not map.get(TileMap.BLOCKED, x, y))
+						
+	if max(x1 - player.x, player.x - x2 + 1) <= TORCH_RADIUS and max(y1 - player.y, player.y - y2 + 1) <= TORCH_RADIUS:
+		fov_recompute = True
 	
-	#create the FOV map, according to the generated map
-	fov_map = libtcod.map_new(MAP_WIDTH, MAP_HEIGHT)
-	for y in range(MAP_HEIGHT):
-		for x in range(MAP_WIDTH):
-			libtcod.map_set_properties(fov_map, x, y, not map[x][y].block_sight, not map[x][y].blocked)
+def update_fov_window():
+	#fill the FOV map from the map tiles under the camera, if the camera moved (or the map changed) since last time
+	global fov_window
+	if fov_window != (map, camera_x, camera_y):
+		fov_window = (map, camera_x, camera_y)
+		fov_lib.map_set_properties_array(fov_map, map.transparent(camera_x, camera_y, CAMERA_WIDTH, CAMERA_HEIGHT),
+			map.walkable(camera_x, camera_y, CAMERA_WIDTH, CAMERA_HEIGHT))
+			
+def look_around():
+	#recompute the FOV if needed and mark everything in view as explored, like render_all does but without
+	#drawing anything, for running the game with no one watching
+	global fov_recompute
+	move_camera(player.x, player.y)
+	if fov_recompute:
+		fov_recompute = False
+		update_fov_window()
+		fov_lib.map_compute_fov(fov_map, player.x - camera_x, player.y - camera_y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
+		visible = fov_lib.map_get_fov_array(fov_map)
+		#only the rows the torch reaches can have anything new in view
+		y1 = max(0, player.y - camera_y - TORCH_RADIUS)
+		y2 = min(CAMERA_HEIGHT, player.y - camera_y + TORCH_RADIUS + 1)
+		explored = map.region(TileMap.EXPLORED, camera_x, camera_y + y1, CAMERA_WIDTH, y2 - y1)
+		explored = plane_int(visible[y1 * CAMERA_WIDTH:y2 * CAMERA_WIDTH]) | plane_int(explored)
+		map.set_region(TileMap.EXPLORED, camera_x, camera_y + y1, CAMERA_WIDTH,
+			int_plane(explored, (y2 - y1) * CAMERA_WIDTH))
+				
+def in_fov(x, y):
+	#whether the player can see the map tile (x, y). nothing is in view until render_all has computed the FOV
+	if fov_window is None: return False
+	(x, y) = (x - fov_window[1], y - fov_window[2])
+	return 0 <= x < CAMERA_WIDTH and 0 <= y < CAMERA_HEIGHT and fov_lib.map_is_in_fov(fov_map, x, y)
 		
 def player_death(player):
 	#the game ended!
@@ -545,7 +1719,7 @@ def monster_death(monster):
 	message(monster.name.capitalize() + ' is dead!', libtcod.orange)
 	monster.char = '%'
 	monster.color = libtcod.dark_red
-	monster.blocks = False
+	object_index.set_blocks(monster, False)
 	monster.ai = None
 	monster.fighter = None
 	monster.ticker = None
@@ -561,8 +1735,8 @@ def player_move_or_attack(dx, dy):
 	
 	#try to find an attackable object there
 	target = None
-	for object in objects:
-		if object.fighter and object.x == x and object.y == y:
+	for object in object_index.at(x, y):
+		if object.fighter:
 			target = object
 			break
 			
@@ -571,7 +1745,8 @@ def player_move_or_attack(dx, dy):
 		player.fighter.attack(target)
 	else:
 		player.move(dx, dy)
-		fov_recompute = True
+		if (player.x, player.y) == (x, y):
+			fov_recompute = True #only see again if the player really moved
 		
 #create function to handle key presses
 def handle_keys():
@@ -583,6 +1758,14 @@ def handle_keys():
 		
 	elif key.vk == libtcod.KEY_ESCAPE:
 		return 'exit'  #exit game
+		
+	elif key.vk == libtcod.KEY_F3:
+		#F3: show or hide the profiler overlay
+		profiler.show_overlay(not profiler.overlay)
+		
+	elif key.vk == libtcod.KEY_F4:
+		#F4: start recording a trace, or stop and write it
+		profiler.record(not profiler.tracing)
 	
 	if game_state == 'playing':
 		#movement keys
@@ -610,8 +1793,8 @@ def handle_keys():
 			
 			if key_char == 'g':
 				#pick up an item
-				for object in objects: #look for an item in the player's tile
-					if object.x == player.x and object.y == player.y and object.item:
+				for object in object_index.at(player.x, player.y): #look for an item in the player's tile
+					if object.item:
 						object.item.pick_up()
 						break
 						
@@ -632,6 +1815,11 @@ def handle_keys():
 				if stairs.x == player.x and stairs.y == player.y:
 					next_level()
 					
+			if key_char == '<':
+				#go back up stairs, if the player is on them
+				if upstairs and upstairs.x == player.x and upstairs.y == player.y:
+					previous_level()
+					
 			if key_char == 'c':
 				#show character info
 				level_up_xp = LEVEL_UP_BASE + player.level * LEVEL_UP_FACTOR
@@ -647,8 +1835,8 @@ def get_names_under_mouse():
 	(x, y) = (camera_x + x, camera_y + y) #from screen to map coordinates
 	
 	#create a list with the names of all objects at the mouse's coordinates and in FOV
-	names = [obj.name for obj in objects
-		if obj.x == x and obj.y == y and libtcod.map_is_in_fov(fov_map, obj.x, obj.y)]
+	names = [obj.name for obj in object_index.at(x, y)
+		if in_fov(obj.x, obj.y)]
 		
 	names = ', '.join(names) #join the names, seperated by commas
 	return names.capitalize()
@@ -679,64 +1867,108 @@ def to_camera_coordinates(x,y):
 		
 	return (x, y)
 	
+def get_chase_field():
+	#the distance-to-player field shared by all chasing monsters, flooded again only once the player has moved
+	global chase_field
+	if chase_field is None or chase_field.tiles is not map or (chase_field.x, chase_field.y) != (player.x, player.y):
+		chase_field = DistanceField(map, player.x, player.y, CHASE_DISTANCE)
+	return chase_field
+	
+def coarse_turns(obj, radius=AI_DETAIL_RADIUS):
+	#how many of its turns a monster can take in one go: 1 (full detail) within radius of the player, more the
+	#further out it is, but never so many that the player and the monster could close the gap to radius meanwhile
+	gap = obj.distance_to(player) - radius
+	if gap < 1:
+		return 1
+	(speed, player_speed) = (obj.fighter.speed, player.fighter.speed)
+	return max(1, min(AI_COARSE_TURNS, int(gap * player_speed / (speed + player_speed))))
+	
+def can_see(x1, y1, x2, y2, radius):
+	#symmetric line of sight between two tiles no further apart than radius: a line can pass a corner one way and
+	#not the other, so it's enough that either way is clear
+	if (x1 - x2) ** 2 + (y1 - y2) ** 2 > radius ** 2:
+		return False
+	return line_is_clear(x1, y1, x2, y2) or line_is_clear(x2, y2, x1, y1)
+	
+def line_is_clear(x1, y1, x2, y2):
+	#whether nothing blocks sight on the Bresenham line from (x1, y1) to (x2, y2), not counting the two ends
+	(dx, dy) = (abs(x2 - x1), abs(y2 - y1))
+	(sx, sy) = (1 if x2 > x1 else -1, 1 if y2 > y1 else -1)
+	err = dx - dy
+	(x, y) = (x1, y1)
+	while (x, y) != (x2, y2):
+		e2 = 2 * err
+		if e2 > -dy:
+			err -= dy
+			x += sx
+		if e2 < dx:
+			err += dx
+			y += sy
+		if (x, y) != (x2, y2) and map.get(TileMap.BLOCK_SIGHT, x, y):
+			return False
+	return True
+	
 def is_blocked(x, y):
 	#first test the map tile
-	if map[x][y].blocked:
+	if map.is_blocked(x, y):
 		return True
 		
 	#now check for any blocking objects
-	for object in objects:
-		if object.blocks and object.x == x and object.y == y:
-			return True
-			
-	return False
+	return object_index.is_blocked(x, y)
 	
 def make_map():
-	global map, objects, stairs, depth
+	global map, objects, stairs, upstairs, depth, object_index
+	
+	seed_streams()
 	
-	#the list of objects with just the player
+	#the list of objects with just the player, parked in the corner (always a wall) until the first room is dug,
+	#so where the player stood on the last level can't change what spawns on this one
+	(player.x, player.y) = (0, 0)
 	objects = [player]
+	object_index = ObjectIndex()
+	object_index.add(player)
 	ticker.recalculate()
 	
 	if depth == 0:
-		#fill map with "blocked" tiles
-		map = [[ Tile(True, explored=True)
-			for y in range(MAP_HEIGHT) ]
-				for x in range(MAP_WIDTH) ]
-		for x in range(1, MAP_WIDTH - 2):
-			for y in range(1, MAP_HEIGHT - 2):
-				map[x][y].blocked = False
-				map[x][y].block_sight = False	
+		#fill map with "blocked" tiles, then open up everything but the border
+		map = TileMap(MAP_WIDTH, MAP_HEIGHT, blocked=True, explored=True)
+		map.carve(1, 1, MAP_WIDTH - 2, MAP_HEIGHT - 2)
 			
 	else:
 		#fill map with "blocked" tiles
-		map = [[ Tile(True)
-			for y in range(MAP_HEIGHT) ]
-				for x in range(MAP_WIDTH) ]
+		map = TileMap(MAP_WIDTH, MAP_HEIGHT, blocked=True)
 			
 	rooms = []
+	room_grid = {} # {(x // ROOM_GRID, y // ROOM_GRID): the rooms touching that cell}
 	num_rooms = 0
 	
-	for r in range(MAX_ROOMS):
+	for r in range(max(1, MAX_ROOMS * MAP_WIDTH * MAP_HEIGHT // (100 * 100))):
 		#random width and height
-		w = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
-		h = libtcod.random_get_int(0, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+		w = libtcod.random_get_int(rng_map, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
+		h = libtcod.random_get_int(rng_map, ROOM_MIN_SIZE, ROOM_MAX_SIZE)
 		#random position without going out of the boundaries of the map
-		x = libtcod.random_get_int(0, 0, MAP_WIDTH - w - 1)
-		y = libtcod.random_get_int(0, 0, MAP_HEIGHT - h - 1)
+		x = libtcod.random_get_int(rng_map, 0, MAP_WIDTH - w - 1)
+		y = libtcod.random_get_int(rng_map, 0, MAP_HEIGHT - h - 1)
 		
 		#"Rect" class makes rectangles easier to work with
 		new_room = Rect(x, y, w, h)
 		
-		#run through the other rooms and see if they intersect with this one
+		#run through the other rooms and see if they intersect with this one (only those filed under the same
+		#grid cells can)
+		cells = new_room.grid_cells()
 		failed = False
-		for other_room in rooms:
-			if new_room.intersect(other_room):
-				failed = True
+		for cell in cells:
+			for other_room in room_grid.get(cell, ()):
+				if new_room.intersect(other_room):
+					failed = True
+					break
+			if failed:
 				break
 		
 		if not failed:
 			#this means there is no intersections, so this room is valid
+			for cell in cells:
+				room_grid.setdefault(cell, []).append(new_room)
 			
 			#"paint" it to the map's tiles
 			create_room(new_room)
@@ -752,8 +1984,7 @@ def make_map():
 				while not placed:
 					if not is_blocked(x, y):
 						#this is the first room, where the player starts at
-						player.x = x
-						player.y = y
+						object_index.move(player, x, y)
 						placed = True
 					else:
 						x += 1
@@ -765,7 +1996,7 @@ def make_map():
 				(prev_x, prev_y) = rooms[num_rooms-1].center()
 				
 				#draw a coin (random number that is either 0 or 1)
-				if libtcod.random_get_int(0, 0, 1) == 1:
+				if libtcod.random_get_int(rng_map, 0, 1) == 1:
 					#first move horizontally, then vertically
 					create_h_tunnel(prev_x, new_x, prev_y)
 					create_v_tunnel(prev_y, new_y, new_x)
@@ -781,36 +2012,114 @@ def make_map():
 	#create stairs at the center of the last room
 	stairs = Object(new_x, new_y, '>', 'stairs', libtcod.white, always_visible = True)
 	objects.append(stairs)
+	object_index.add(stairs)
 	stairs.send_to_back() #so it's drawn below monsters
+	
+	#and stairs back up where the player comes in, below the surface
+	upstairs = None
+	if depth > 0:
+		upstairs = Object(player.x, player.y, '<', 'stairs up', libtcod.white, always_visible = True)
+		objects.append(upstairs)
+		object_index.add(upstairs)
+		upstairs.send_to_back()
 
 def next_level():
-	global depth
-	
 	#advance to the next level
 	message('You decend deeper into the heart of the earth...', libtcod.red)
-	depth += 1
-	make_map() #create a fresh new level!
+	change_level(depth + 1)
+	
+def previous_level():
+	#climb back to the level above
+	message('You climb back up towards the surface...', libtcod.red)
+	change_level(depth - 1)
+	
+def change_level(new_depth):
+	global depth
+	
+	#freeze the level being left, then thaw the new one if it was visited before, or take it from the pregenerator
+	dormant_levels[depth] = encode_save(snapshot_game(level_only=True))
+	depth = new_depth
+	data = dormant_levels.pop(depth, None) or pregenerator.take(game_seed, depth)
+	if data:
+		adopt_level(decode_save(data))
+	else:
+		make_map() #create a fresh new level!
 	initialize_fov()
+	pregenerate_next_level()
+	
+def pregenerate_next_level():
+	if depth + 1 not in dormant_levels:
+		pregenerator.request(game_seed, depth + 1)
+	
+def generate_level(seed, level_depth, map_size):
+	#runs in the pregenerator's worker process: make the level with a stand-in player and return it save encoded.
+	#map_size is (MAP_WIDTH, MAP_HEIGHT, MAX_ROOMS) as the game has them, a spawned worker starts from the defaults
+	global game_seed, depth, player, ticker, game_state, MAP_WIDTH, MAP_HEIGHT, MAX_ROOMS
+	
+	(game_seed, depth) = (seed, level_depth)
+	(MAP_WIDTH, MAP_HEIGHT, MAX_ROOMS) = map_size
+	player = Object(0, 0, '@', 'player', libtcod.white, blocks=True)
+	ticker = Ticker()
+	game_state = 'playing'
+	make_map()
+	return encode_save(snapshot_game(level_only=True))
+	
+def adopt_level(level):
+	#swap in a level frozen by change_level or made by generate_level, the player taking the stand-in's place
+	global map, objects, stairs, upstairs, object_index
+	
+	map = level['map']
+	objects = level['objects']
+	stand_in = objects[level['player_index']]
+	(player.x, player.y) = (stand_in.x, stand_in.y)
+	objects[level['player_index']] = player
+	stairs = objects[level['stairs_index']]
+	upstairs = objects[level['upstairs_index']] if level['upstairs_index'] >= 0 else None
+	
+	object_index = ObjectIndex()
+	object_index.rebuild(objects)
+	
+	#time stood still on the level while it was away, so its schedule carries on from now
+	ticker.recalculate()
+	for (tick, order, obj) in sorted(level['ticker'].schedule):
+		obj.ticker = ticker
+		ticker.schedule_turn(tick - level['ticker'].ticks, obj)
+	
+def seed_streams():
+	#(re)seed the map and spawn generators for the current depth, before generating it
+	global rng_map, rng_spawns
+	
+	for rng in (rng_map, rng_spawns):
+		if rng is not None:
+			libtcod.random_delete(rng)
+	rng_map = libtcod.random_new_from_seed(stream_seed(game_seed, depth, RNG_MAP))
+	rng_spawns = libtcod.random_new_from_seed(stream_seed(game_seed, depth, RNG_SPAWNS))
+	
+def seed_combat_stream():
+	#(re)seed the combat/AI generator at the start of a game or on loading one. the tick count tells loads of
+	#different saves apart, while loading the same save twice plays out the same way
+	global rng_combat
+	
+	if rng_combat is not None:
+		libtcod.random_delete(rng_combat)
+	rng_combat = libtcod.random_new_from_seed(stream_seed(game_seed, ticker.ticks, RNG_COMBAT))
+	
+def stream_seed(seed, n, stream):
+	#mix the game seed, a depth (or tick count) and stream number into one 32 bit seed
+	return zlib.crc32(struct.pack('<III', seed & 0xffffffff, n & 0xffffffff, stream)) & 0xffffffff
 			
 def create_room(room):
 	global map
-	#go through the tiles in the rectangle and make them passable
-	for x in range(room.x1 + 1, room.x2):
-		for y in range(room.y1 + 1, room.y2):
-			map[x][y].blocked = False
-			map[x][y].block_sight = False
+	#make the tiles inside the rectangle passable
+	map.carve(room.x1 + 1, room.y1 + 1, room.x2, room.y2)
 			
 def create_h_tunnel(x1, x2, y):
 	global map
-	for x in range(min(x1, x2), max(x1, x2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.carve(min(x1, x2), y, max(x1, x2) + 1, y + 1)
 		
 def create_v_tunnel(y1, y2, x):
 	global map
-	for y in range(min(y1, y2), max(y1, y2) + 1):
-		map[x][y].blocked = False
-		map[x][y].block_sight = False
+	map.carve(x, min(y1, y2), x + 1, max(y1, y2) + 1)
 
 def message(new_msg, color = libtcod.white):
 	#split the message if necessary, among mulitple lines
@@ -844,57 +2153,69 @@ def render_bar(x, y, total_width, name, value, maximum, bar_color, back_color):
 def render_all():
 	global fov_map, color_light_wall, color_dark_wall
 	global color_light_ground, color_dark_ground
-	global fov_recompute, level_up_xp
+	global fov_recompute, level_up_xp, painted
 	
 	move_camera(player.x, player.y)
 
 	if fov_recompute:
 		#recompute FOV if needed (the player moved or something)
 		fov_recompute = False
-		libtcod.map_compute_fov(fov_map, player.x, player.y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
-		libtcod.console_clear(con)
+		with profiler.phase('fov'):
+			update_fov_window()
+			fov_lib.map_compute_fov(fov_map, player.x - camera_x, player.y - camera_y, TORCH_RADIUS, FOV_LIGHT_WALLS, FOV_ALGO)
 		
-		for y in range(CAMERA_HEIGHT):
-			for x in range(CAMERA_WIDTH):
-				(map_x, map_y) = (camera_x + x, camera_y + y)
-				visible = libtcod.map_is_in_fov(fov_map, map_x, map_y)
-				
-				wall = map[map_x][map_y].block_sight
-				if not visible:
-					#it's out of the player's FOV
-					if map[map_x][map_y].explored:
-					#if it's not visible right now, the player can only see it if it's explored
-						if wall:
-							libtcod.console_set_char_background(con, x, y, color_dark_wall, libtcod.BKGND_SET )
-						else:
-							libtcod.console_set_char_background(con, x, y, color_dark_ground, libtcod.BKGND_SET )
-				else:
-					#it's visible
-					if wall:
-						libtcod.console_set_char_background(con, x, y, color_light_wall, libtcod.BKGND_SET )
-					else:
-						libtcod.console_set_char_background(con, x, y, color_light_ground, libtcod.BKGND_SET )
-					map[map_x][map_y].explored = True
-					
+		if painted and painted[:2] != (camera_x, camera_y):
+			scroll_con(camera_x - painted[0], camera_y - painted[1])
+			
+		#work out the background code of all camera cells from the map planes and the FOV in one go, and the
+		#cells whose code differs from what is painted on con
+		visible = fov_lib.map_get_fov_array(fov_map)
+		codes = cell_codes(visible, map.region(TileMap.BLOCK_SIGHT, camera_x, camera_y, CAMERA_WIDTH, CAMERA_HEIGHT),
+			map.region(TileMap.EXPLORED, camera_x, camera_y, CAMERA_WIDTH, CAMERA_HEIGHT))
+		changed = None
+		if painted and painted[:2] == (camera_x, camera_y):
+			changed = changed_cells(painted[2], codes, CAMERA_WIDTH * CAMERA_HEIGHT // 4)
+			
+		#everything visible right now is explored from now on
+		map.set_region(TileMap.EXPLORED, camera_x, camera_y, CAMERA_WIDTH, codes.translate(explored_table))
+			
+		if changed is None:
+			#repaint the whole background in a single call
+			libtcod.console_clear(con)
+			libtcod.console_fill_background(con, codes.translate(background_tables[0]), codes.translate(background_tables[1]),
+				codes.translate(background_tables[2]))
+			dirty.mark_all()
+		else:
+			#only repaint the cells that changed
+			for i in changed:
+				(x, y) = (i % CAMERA_WIDTH, i // CAMERA_WIDTH)
+				libtcod.console_set_char_background(con, x, y, background_colors[codes[i]], libtcod.BKGND_SET)
+				dirty.mark(x, y)
+		painted = (camera_x, camera_y, codes)
+		
+
 	#draw all objects in the list
 	for object in objects:
 		if object != player:
 			object.draw()
 	player.draw()
 	
-	#blit the contents of "con" to the root console
-	libtcod.console_blit(con, 0, 0, MAP_WIDTH, MAP_HEIGHT, 0, 0, 0)
+	#blit the cells of "con" that changed to the root console
+	dirty.blit(con, 0, 0)
 	
 	#prepare to render the GUI panel
 	libtcod.console_set_default_background(panel, libtcod.black)
 	libtcod.console_clear(panel)
 	
-	#print the game messages, one line at a time
-	y = 1
-	for (line, color) in game_msgs:
-		libtcod.console_set_default_foreground(panel, color)
-		libtcod.console_print_ex(panel, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
-		y += 1
+	#print the game messages, one line at a time (the profiler overlay takes their place while it's shown)
+	if profiler.overlay:
+		profiler.draw_overlay(panel, MSG_X, 1)
+	else:
+		y = 1
+		for (line, color) in game_msgs:
+			libtcod.console_set_default_foreground(panel, color)
+			libtcod.console_print_ex(panel, MSG_X, y, libtcod.BKGND_NONE, libtcod.LEFT, line)
+			y += 1
 	
 	#show the player's stats
 	render_bar(1, 1, BAR_WIDTH, 'HP', player.fighter.hp, player.fighter.max_hp, libtcod.light_red, libtcod.darker_red)
@@ -910,6 +2231,27 @@ def render_all():
 	#blit the contents of "panel" to the root console
 	libtcod.console_blit(panel, 0, 0, SCREEN_WIDTH, PANEL_HEIGHT, 0, 0, PANEL_Y)
 
+def scroll_con(dx, dy):
+	#the camera moved by (dx, dy): shift what is painted on con the other way with one blit, so that only the strips
+	#it uncovers need painting. their painted code becomes 255, which never matches a real one
+	global con, con_scratch, painted
+	(w, h) = (CAMERA_WIDTH - abs(dx), CAMERA_HEIGHT - abs(dy))
+	if w <= 0 or h <= 0:
+		painted = None #nothing left in view, paint it all
+		return
+		
+	libtcod.console_clear(con_scratch)
+	libtcod.console_blit(con, max(dx, 0), max(dy, 0), w, h, con_scratch, max(-dx, 0), max(-dy, 0))
+	(con, con_scratch) = (con_scratch, con)
+	
+	(old, codes) = (painted[2], bytearray([255]) * (CAMERA_WIDTH * CAMERA_HEIGHT))
+	for y in range(h):
+		source = (y + max(dy, 0)) * CAMERA_WIDTH + max(dx, 0)
+		dest = (y + max(-dy, 0)) * CAMERA_WIDTH + max(-dx, 0)
+		codes[dest:dest + w] = old[source:source + w]
+	painted = (painted[0] + dx, painted[1] + dy, codes)
+	dirty.mark_all()
+	
 def place_objects(room):
 	#maximum number of monsters per room
 	max_monsters = from_depth([[2,0],[3,4],[5,6]])
@@ -933,15 +2275,15 @@ def place_objects(room):
 	item_chances['shield'] = from_depth([[15,8]])
 	
 	#choose random number of monsters
-	num_monsters = libtcod.random_get_int(0, 0, max_monsters)
+	num_monsters = libtcod.random_get_int(rng_spawns, 0, max_monsters)
 	
 	for i in range(num_monsters):
 		#choose random spot for this monster
-		x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-		y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+		x = libtcod.random_get_int(rng_spawns, room.x1+1, room.x2-1)
+		y = libtcod.random_get_int(rng_spawns, room.y1+1, room.y2-1)
 		
 		if not is_blocked(x, y):
-			choice = random_choice(monster_chances)
+			choice = random_choice(monster_chances, rng_spawns)
 			if choice == 'orc': #80% chance of getting an orc
 				#create an orc
 				ai_component = BasicMonster()
@@ -959,18 +2301,19 @@ def place_objects(room):
 				monster = Object(x, y, '@', 'dungeon bunny', libtcod.light_yellow, blocks=True, fighter=fighter_component, ai=ai_component)
 			
 			objects.append(monster)
+			object_index.add(monster)
 			
 	#choose random number of items
-	num_items = libtcod.random_get_int(0, 0, max_items)
+	num_items = libtcod.random_get_int(rng_spawns, 0, max_items)
 	
 	for i in range(num_items):
 		#choose random spot for this item
-		x = libtcod.random_get_int(0, room.x1+1, room.x2-1)
-		y = libtcod.random_get_int(0, room.y1+1, room.y2-1)
+		x = libtcod.random_get_int(rng_spawns, room.x1+1, room.x2-1)
+		y = libtcod.random_get_int(rng_spawns, room.y1+1, room.y2-1)
 		
 		#only place it if the tile is not blocked
 		if not is_blocked(x, y):
-			choice = random_choice(item_chances)
+			choice = random_choice(item_chances, rng_spawns)
 			if choice == 'heal': #70%
 				#create a healing potion (70% chance)
 				item_component = Item(use_function = cast_heal)
@@ -997,12 +2340,14 @@ def place_objects(room):
 				item = Object(x, y, '[', 'shield', libtcod.darker_orange, equipment=equipment_component)
 			
 			objects.append(item)
+			object_index.add(item)
 			item.send_to_back() #items appear below other objects
 
 def menu(header, options, width):
 	global key
 
 	if len(options) > 26: raise ValueError('Cannot have a menu with more than 26 options.')
+	if autopilot is not None: return autopilot.choose(header, options)
 	
 	#calculate total height for the header (after auto-wrap) and one line per option
 	header_height = libtcod.console_get_height_rect(con, 0, 0, width, SCREEN_HEIGHT, header)
@@ -1030,6 +2375,7 @@ def menu(header, options, width):
 	x = SCREEN_WIDTH/2 - width/2
 	y = SCREEN_HEIGHT/2 - height/2
 	libtcod.console_blit(window, 0, 0, width, height, 0, x, y, 1.0, 0.7)
+	dirty.mark_all() #the map under the window has to be blitted again once it closes
 	
 	#present the root console to the player and wait for a key-press
 	libtcod.console_flush()
@@ -1145,7 +2491,7 @@ def closest_monster(max_range):
 	closest_dist = max_range + 1
 	
 	for object in objects:
-		if object.fighter and not object == player and libtcod.map_is_in_fov(fov_map, object.x, object.y):
+		if object.fighter and not object == player and in_fov(object.x, object.y):
 			#calculate distance between this object and the player
 			dist = player.distance_to(object)
 			if dist < closest_dist: #it's closer, so remember it
@@ -1156,6 +2502,7 @@ def closest_monster(max_range):
 def target_tile(max_range=None):
 	#return the position of a tile left-clicked in the player's FOV (optionally in a range), or (None,None) if right-clicked
 	global key, mouse
+	if autopilot is not None: return autopilot.target(max_range)
 	while True:
 		#render the screen. this erases the inventory and shows the names of objects under the mouse.
 		libtcod.console_flush()
@@ -1165,7 +2512,7 @@ def target_tile(max_range=None):
 		(x, y) = (mouse.cx, mouse.cy)
 		(x, y) = (camera_x + x, camera_y + y)  #from screen to map coordinates
 		
-		if (mouse.lbutton_pressed and libtcod.map_is_in_fov(fov_map, x, y) and (max_range is None or player.distance(x, y) <= max_range)):
+		if (mouse.lbutton_pressed and in_fov(x, y) and (max_range is None or player.distance(x, y) <= max_range)):
 			return (x, y)
 			
 		if mouse.rbutton_pressed or key.vk == libtcod.KEY_ESCAPE:
@@ -1179,8 +2526,8 @@ def target_monster(max_range = None):
 			return None
 		
 		#return the first clicked monster, otherwise continue looping
-		for obj in objects:
-			if obj.x == x and obj.y == y and obj.fighter and obj != player:
+		for obj in object_index.at(x, y):
+			if obj.fighter and obj != player:
 				return obj
 
 def check_level_up():
@@ -1208,10 +2555,10 @@ def check_level_up():
 			elif choice == 2:
 				player.fighter.base_defense += 1
 
-def random_choice_index(chances): 
+def random_choice_index(chances, rng=0): 
 	#choose one option from list of chances, returning its index
 	#the dice will land on some number between 1 and the sum of the chances
-	dice = libtcod.random_get_int(0, 1, sum(chances))
+	dice = libtcod.random_get_int(rng, 1, sum(chances))
 	
 	#go through all chances, keeping the sum so far
 	running_sum = 0
@@ -1224,12 +2571,13 @@ def random_choice_index(chances):
 			return choice
 		choice += 1
 
-def random_choice(chances_dict):
+def random_choice(chances_dict, rng=0):
 	#choose one option from dictionary of chances, returning its key
-	chances = chances_dict.values()
-	strings = chances_dict.keys()
+	#(keys are sorted so the result doesn't depend on dictionary order)
+	strings = sorted(chances_dict.keys())
+	chances = [chances_dict[s] for s in strings]
 	
-	return strings[random_choice_index(chances)]
+	return strings[random_choice_index(chances, rng)]
 
 def from_depth(table):
 	#returns a value that depends on level. the table specifies what value occurs after each level, default is 0.
@@ -1239,19 +2587,13 @@ def from_depth(table):
 	return 0
 	
 def get_equipped_in_slot(slot): #returns the equipment in a slot, or None if it's empty
-	for obj in inventory:
-		if obj.equipment and obj.equipment.slot == slot and obj.equipment.is_equipped:
-			return obj.equipment
-	return None
+	return equipped_slots.get(slot)
 	
 def get_all_equipped(obj): #returns a list of equipped items
 	if obj == player:
-		equipped_list = []
-		for item in inventory:
-			if item.equipment and item.equipment.is_equipped:
-				equipped_list.append(item.equipment)
-		return equipped_list
+		return list(equipped_slots.values())
 	else:
 		return [] #other objects have no equipment
 	
-main_menu()
+if __name__ == '__main__':
+	main_menu()
@@ -0,0 +1,109 @@
+#
+# FOV benchmark: libtcod's map_compute_fov against shadowcast.py
+#
+# usage: python fovbench.py [calls per map]
+#
+# computes the FOV of the same origins on a few camera-sized test maps with
+# both engines and prints the time per call, and how many of the cells
+# either of them lights the two agree on (they are different algorithms, so
+# they never agree on all of them; the cells both leave dark, most of the
+# map, don't count). set LIBTCOD_BACKEND=headless to run it without the C
+# library, in which case the "libtcod" column is libtcodheadless.py's Python
+# FOV.
+#
+
+import random
+import sys
+import timeit
+
+import libtcodpy as libtcod
+import shadowcast
+
+WIDTH = 80
+HEIGHT = 43
+RADIUS = 10
+LIGHT_WALLS = True
+
+
+def open_map(rng):
+    # one big room
+    return bytearray([0 < x < WIDTH - 1 and 0 < y < HEIGHT - 1 for y in range(HEIGHT) for x in range(WIDTH)])
+
+
+def cave_map(rng):
+    # scattered pillars: lots of small shadows
+    return bytearray([0 < x < WIDTH - 1 and 0 < y < HEIGHT - 1 and rng.random() > 0.3
+                      for y in range(HEIGHT) for x in range(WIDTH)])
+
+
+def rooms_map(rng):
+    # rooms joined by one tile corridors, like the dungeon levels
+    cells = bytearray(WIDTH * HEIGHT)
+
+    def carve(x1, y1, x2, y2):
+        for y in range(y1, y2):
+            cells[y * WIDTH + x1:y * WIDTH + x2] = bytearray([1]) * (x2 - x1)
+
+    previous = None
+    for i in range(12):
+        (w, h) = (rng.randint(6, 12), rng.randint(5, 9))
+        (x, y) = (rng.randint(1, WIDTH - w - 1), rng.randint(1, HEIGHT - h - 1))
+        carve(x, y, x + w, y + h)
+        center = (x + w // 2, y + h // 2)
+        if previous:
+            carve(min(previous[0], center[0]), previous[1], max(previous[0], center[0]) + 1, previous[1] + 1)
+            carve(center[0], min(previous[1], center[1]), center[0] + 1, max(previous[1], center[1]) + 1)
+        previous = center
+    return cells
+
+
+MAPS = [('open', open_map), ('cave', cave_map), ('rooms', rooms_map)]
+
+
+def run(calls):
+    rng = random.Random(1)
+    results = []
+    for (name, make) in MAPS:
+        transparent = make(rng)
+        floors = [i for i in range(WIDTH * HEIGHT) if transparent[i]]
+        origins = [divmod(rng.choice(floors), WIDTH) for i in range(calls)]
+
+        c_map = libtcod.map_new(WIDTH, HEIGHT)
+        libtcod.map_set_properties_array(c_map, transparent, transparent)
+        py_map = shadowcast.map_new(WIDTH, HEIGHT)
+        shadowcast.map_set_properties_array(py_map, transparent, transparent)
+        shadowcast.precompute(RADIUS)
+
+        timings = {}
+        (agree, lit) = (0, 0)
+        for (engine, m) in ((libtcod, c_map), (shadowcast, py_map)):
+            start = timeit.default_timer()
+            for (y, x) in origins:
+                engine.map_compute_fov(m, x, y, RADIUS, LIGHT_WALLS, 0)
+            timings[engine] = (timeit.default_timer() - start) * 1000.0 / calls
+        compared = origins[:20]
+        for (y, x) in compared:
+            libtcod.map_compute_fov(c_map, x, y, RADIUS, LIGHT_WALLS, 0)
+            shadowcast.map_compute_fov(py_map, x, y, RADIUS, LIGHT_WALLS)
+            c_fov = libtcod.map_get_fov_array(c_map)
+            py_fov = shadowcast.map_get_fov_array(py_map)
+            for (a, b) in zip(c_fov, py_fov):
+                if a or b:
+                    lit += 1
+                    agree += bool(a) == bool(b)
+        libtcod.map_delete(c_map)
+        results.append((name, timings[libtcod], timings[shadowcast], 100.0 * agree / max(lit, 1)))
+    return results
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print('%d calls per map, radius %d, %dx%d, %s' % (calls, RADIUS, WIDTH, HEIGHT,
+                                                   'headless libtcod' if libtcod.HEADLESS else 'C libtcod'))
+    print('%-8s %14s %14s %15s' % ('map', 'libtcod ms', 'shadowcast ms', 'agree % of lit'))
+    for (name, c_ms, py_ms, agree) in run(calls):
+        print('%-8s %14.3f %14.3f %15.2f' % (name, c_ms, py_ms, agree))
+
+
+if __name__ == '__main__':
+    main()
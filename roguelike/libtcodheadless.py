@@ -0,0 +1,896 @@
+#
+# headless stand-in for the libtcod C library
+#
+# libtcodpy loads this instead of libtcod.so / libtcod-mingw.dll when the
+# LIBTCOD_BACKEND environment variable is set to "headless". It implements,
+# in plain Python, the TCOD_* entry points the game goes through: consoles,
+# colors, the FOV map, random number generators, images and input. Nothing
+# is ever shown on screen, and input comes from a queue filled with
+# push_key() / push_mouse(). the FOV is computed with FOV_BASIC or FOV_SHADOW
+# (FOV_ALGORITHMS); other algorithms raise NotImplementedError. entry points
+# that are not implemented at all (paths, BSP trees, heightmaps, noise, the
+# parser, and a few console, image and color functions) can't be called:
+# libtcodpy leaves out the wrappers that need them when it selects this
+# backend, and lists them in libtcodpy.HEADLESS_UNSUPPORTED.
+#
+# maps are laid out in memory exactly like libtcod's own (a width, height,
+# nbcells, cells header followed by one byte of transparent | walkable << 1
+# | fov << 2 flags per cell), so the bulk map functions in libtcodpy work
+# on them unchanged.
+#
+
+import ctypes
+import random
+import struct
+import sys
+import textwrap
+import time
+from ctypes import *
+
+BKGND_NONE = 0
+BKGND_SET = 1
+BKGND_MULTIPLY = 2
+BKGND_LIGHTEN = 3
+BKGND_DARKEN = 4
+BKGND_SCREEN = 5
+BKGND_ADD = 8
+BKGND_ALPH = 12
+BKGND_DEFAULT = 13
+
+LEFT = 0
+RIGHT = 1
+CENTER = 2
+
+EVENT_KEY_PRESS = 1
+EVENT_MOUSE = 4 | 8 | 16
+
+KEY_NONE = 0
+KEY_CHAR = 65
+
+CELL_TRANSPARENT = 1
+CELL_WALKABLE = 2
+CELL_FOV = 4
+
+FOV_BASIC = 0
+FOV_SHADOW = 2
+FOV_ALGORITHMS = (FOV_BASIC, FOV_SHADOW)
+
+# octant transforms of libtcod's recursive shadowcasting: (xx, xy, yx, yy) per octant
+_OCTANTS = [(1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+            (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1)]
+
+
+def _value(arg):
+    # unwrap the ctypes values libtcodpy passes to the C functions
+    if isinstance(arg, ctypes._SimpleCData):
+        arg = arg.value
+    if isinstance(arg, bytes) and not isinstance(arg, str):
+        arg = arg.decode('latin-1')
+    return arg
+
+
+def _handle(arg):
+    # consoles, maps and generators are passed as plain ints or c_void_p;
+    # a NULL console is the root console and a NULL generator the default one
+    arg = _value(arg)
+    if arg is None:
+        return 0
+    return arg
+
+
+def _color(r, g, b):
+    # libtcodpy is fully imported by the time any color is built
+    return sys.modules['libtcodpy'].Color(r, g, b)
+
+
+def _clamp(v):
+    return max(0, min(255, int(v)))
+
+
+class _Unsupported(object):
+    # an entry point the headless backend doesn't provide. it only exists so
+    # that libtcodpy can set restype on it while loading: the wrappers that
+    # would call it are left out (see supports)
+    def __init__(self, name):
+        self.name = name
+
+
+class _Entry(object):
+    # wraps a backend method so libtcodpy can set restype on it like on a C function
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *args):
+        return self.func(*args)
+
+
+class _CMap(Structure):
+    _fields_ = [('width', c_int),
+                ('height', c_int),
+                ('nbcells', c_int),
+                ('cells', c_void_p),
+                ]
+
+
+class Console(object):
+    # a console is one list of characters and six bytearrays of color channels
+    def __init__(self, w, h):
+        self.width = w
+        self.height = h
+        self.default_fore = (255, 255, 255)
+        self.default_back = (0, 0, 0)
+        self.bkgnd_flag = BKGND_NONE
+        self.alignment = LEFT
+        self.key_color = None
+        self.clear()
+
+    def clear(self):
+        n = self.width * self.height
+        self.char = [ord(' ')] * n
+        self.fore = [bytearray([c]) * n for c in self.default_fore]
+        self.back = [bytearray([c]) * n for c in self.default_back]
+
+    def contains(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get_back(self, i):
+        return (self.back[0][i], self.back[1][i], self.back[2][i])
+
+    def get_fore(self, i):
+        return (self.fore[0][i], self.fore[1][i], self.fore[2][i])
+
+    def set_back(self, i, col, flag):
+        if flag == BKGND_DEFAULT:
+            flag = self.bkgnd_flag
+        alpha = ((flag >> 8) & 0xff) / 255.0
+        flag &= 0xff
+        if flag == BKGND_NONE:
+            return
+        if flag == BKGND_SET:
+            self.back[0][i], self.back[1][i], self.back[2][i] = col
+            return
+        old = self.get_back(i)
+        if flag == BKGND_MULTIPLY:
+            new = [o * c / 255 for o, c in zip(old, col)]
+        elif flag == BKGND_LIGHTEN:
+            new = [max(o, c) for o, c in zip(old, col)]
+        elif flag == BKGND_DARKEN:
+            new = [min(o, c) for o, c in zip(old, col)]
+        elif flag == BKGND_SCREEN:
+            new = [255 - (255 - o) * (255 - c) / 255 for o, c in zip(old, col)]
+        elif flag == BKGND_ADD:
+            new = [o + c for o, c in zip(old, col)]
+        elif flag == BKGND_ALPH:
+            new = [o + (c - o) * alpha for o, c in zip(old, col)]
+        else:
+            new = col
+        for channel in range(3):
+            self.back[channel][i] = _clamp(new[channel])
+
+    def set_fore(self, i, col):
+        for channel in range(3):
+            self.fore[channel][i] = col[channel]
+
+    def put_char(self, x, y, c, flag):
+        if not self.contains(x, y):
+            return
+        i = y * self.width + x
+        self.char[i] = c
+        self.set_fore(i, self.default_fore)
+        self.set_back(i, self.default_back, flag)
+
+    def print_line(self, x, y, flag, alignment, text):
+        if alignment == RIGHT:
+            x -= len(text) - 1
+        elif alignment == CENTER:
+            x -= len(text) // 2
+        for c in text:
+            self.put_char(x, y, ord(c), flag)
+            x += 1
+
+    def wrap(self, w, text):
+        lines = []
+        for paragraph in text.split('\n'):
+            lines.extend(textwrap.wrap(paragraph, max(w, 1)) or [''])
+        return lines
+
+
+class Map(object):
+    # an FOV map, kept in memory with the same layout libtcod uses
+    def __init__(self, w, h):
+        self.width = w
+        self.height = h
+        self.cells = bytearray(w * h)
+        self.cbuf = (c_uint8 * max(w * h, 1)).from_buffer(self.cells)
+        self.header = _CMap(w, h, w * h, addressof(self.cbuf))
+
+
+class HeadlessLibrary(object):
+    def __init__(self):
+        self.consoles = {0: Console(80, 50)}
+        self.maps = {}
+        self.generators = {0: random.Random()}
+        self.images = {}
+        self.next_handle = 1
+        self.keys = []
+        self.mouse_events = []
+        self.window_closed = False
+        self.fullscreen = False
+        self.fps = 0
+        self.frames = 0
+        self.start = time.time()
+        self.last_flush = self.start
+        self.last_frame_length = 0.0
+        for name in dir(self):
+            if name.startswith('TCOD_'):
+                self.__dict__[name] = _Entry(getattr(self, name))
+
+    def __getattr__(self, name):
+        if not name.startswith('TCOD_'):
+            raise AttributeError(name)
+        unsupported = _Unsupported(name)
+        self.__dict__[name] = unsupported
+        return unsupported
+
+    def supports(self, name):
+        # whether the backend implements the entry point
+        return name.startswith('TCOD_') and hasattr(HeadlessLibrary, name)
+
+    def new_handle(self):
+        handle = self.next_handle
+        self.next_handle += 1
+        return handle
+
+    # input queue
+    def push_key(self, vk, c=0, **modifiers):
+        # queue a key press. printable keys use vk=KEY_CHAR and c=ord(char)
+        self.window_closed = False
+        self.keys.append(dict(vk=vk, c=c, pressed=True, **modifiers))
+
+    def push_mouse(self, cx, cy, lbutton_pressed=False, rbutton_pressed=False):
+        # queue a mouse event at the given cell
+        self.mouse_events.append(dict(cx=cx, cy=cy, x=cx * 8, y=cy * 8,
+                                      lbutton_pressed=lbutton_pressed,
+                                      rbutton_pressed=rbutton_pressed))
+
+    def fill_key(self, key, mask=EVENT_KEY_PRESS):
+        for name, ctype in key._fields_:
+            setattr(key, name, 0)
+        if self.keys and mask & EVENT_KEY_PRESS:
+            for name, v in self.keys.pop(0).items():
+                setattr(key, name, v)
+            return EVENT_KEY_PRESS
+        return 0
+
+    def fill_mouse(self, mouse, mask):
+        for name in ('lbutton_pressed', 'rbutton_pressed', 'mbutton_pressed',
+                     'dx', 'dy', 'dcx', 'dcy'):
+            setattr(mouse, name, 0)
+        if self.mouse_events and mask & EVENT_MOUSE:
+            for name, v in self.mouse_events.pop(0).items():
+                setattr(mouse, name, v)
+            return 8 if mouse.lbutton_pressed or mouse.rbutton_pressed else 4
+        return 0
+
+    # color module
+    def TCOD_color_equals(self, c1, c2):
+        return tuple(c1) == tuple(c2)
+
+    def TCOD_color_add(self, c1, c2):
+        return _color(*[_clamp(a + b) for a, b in zip(c1, c2)])
+
+    def TCOD_color_subtract(self, c1, c2):
+        return _color(*[_clamp(a - b) for a, b in zip(c1, c2)])
+
+    def TCOD_color_multiply(self, c1, c2):
+        return _color(*[a * b // 255 for a, b in zip(c1, c2)])
+
+    def TCOD_color_multiply_scalar(self, c, v):
+        v = _value(v)
+        return _color(*[_clamp(a * v) for a in c])
+
+    def TCOD_color_lerp(self, c1, c2, coef):
+        coef = _value(coef)
+        return _color(*[_clamp(a + (b - a) * coef) for a, b in zip(c1, c2)])
+
+    # console module
+    def console(self, con):
+        return self.consoles[_handle(con)]
+
+    def TCOD_console_init_root(self, w, h, title, fullscreen, renderer):
+        self.consoles[0] = Console(w, h)
+        self.fullscreen = bool(_value(fullscreen))
+
+    def TCOD_console_set_custom_font(self, *args):
+        pass
+
+    def TCOD_console_set_window_title(self, title):
+        pass
+
+    def TCOD_console_is_fullscreen(self):
+        return self.fullscreen
+
+    def TCOD_console_set_fullscreen(self, fullscreen):
+        self.fullscreen = bool(_value(fullscreen))
+
+    def TCOD_console_is_window_closed(self):
+        return self.window_closed
+
+    def TCOD_console_credits(self):
+        pass
+
+    def TCOD_console_flush(self):
+        now = time.time()
+        self.last_frame_length = now - self.last_flush
+        self.last_flush = now
+        self.frames += 1
+
+    def TCOD_console_new(self, w, h):
+        handle = self.new_handle()
+        self.consoles[handle] = Console(w, h)
+        return handle
+
+    def TCOD_console_delete(self, con):
+        self.consoles.pop(_handle(con), None)
+
+    def TCOD_console_get_width(self, con):
+        return self.console(con).width
+
+    def TCOD_console_get_height(self, con):
+        return self.console(con).height
+
+    def TCOD_console_set_default_background(self, con, col):
+        self.console(con).default_back = tuple(col)
+
+    def TCOD_console_set_default_foreground(self, con, col):
+        self.console(con).default_fore = tuple(col)
+
+    def TCOD_console_get_default_background(self, con):
+        return _color(*self.console(con).default_back)
+
+    def TCOD_console_get_default_foreground(self, con):
+        return _color(*self.console(con).default_fore)
+
+    def TCOD_console_set_background_flag(self, con, flag):
+        self.console(con).bkgnd_flag = _value(flag)
+
+    def TCOD_console_get_background_flag(self, con):
+        return self.console(con).bkgnd_flag
+
+    def TCOD_console_set_alignment(self, con, alignment):
+        self.console(con).alignment = _value(alignment)
+
+    def TCOD_console_get_alignment(self, con):
+        return self.console(con).alignment
+
+    def TCOD_console_set_key_color(self, con, col):
+        self.console(con).key_color = tuple(col)
+
+    def TCOD_console_clear(self, con):
+        self.console(con).clear()
+
+    def TCOD_console_put_char(self, con, x, y, c, flag):
+        self.console(con).put_char(x, y, c, flag)
+
+    def TCOD_console_put_char_ex(self, con, x, y, c, fore, back):
+        console = self.console(con)
+        if console.contains(x, y):
+            i = y * console.width + x
+            console.char[i] = c
+            console.set_fore(i, tuple(fore))
+            console.set_back(i, tuple(back), BKGND_SET)
+
+    def TCOD_console_set_char(self, con, x, y, c):
+        console = self.console(con)
+        if console.contains(x, y):
+            console.char[y * console.width + x] = c
+
+    def TCOD_console_set_char_background(self, con, x, y, col, flag):
+        console = self.console(con)
+        if console.contains(x, y):
+            console.set_back(y * console.width + x, tuple(col), _value(flag))
+
+    def TCOD_console_set_char_foreground(self, con, x, y, col):
+        console = self.console(con)
+        if console.contains(x, y):
+            console.set_fore(y * console.width + x, tuple(col))
+
+    def TCOD_console_get_char(self, con, x, y):
+        console = self.console(con)
+        return console.char[y * console.width + x]
+
+    def TCOD_console_get_char_background(self, con, x, y):
+        console = self.console(con)
+        return _color(*console.get_back(y * console.width + x))
+
+    def TCOD_console_get_char_foreground(self, con, x, y):
+        console = self.console(con)
+        return _color(*console.get_fore(y * console.width + x))
+
+    def TCOD_console_print_ex(self, con, x, y, flag, alignment, fmt):
+        console = self.console(con)
+        for line in _value(fmt).split('\n'):
+            console.print_line(x, y, _value(flag), _value(alignment), line)
+            y += 1
+
+    TCOD_console_print_ex_utf = TCOD_console_print_ex
+
+    def TCOD_console_print(self, con, x, y, fmt):
+        console = self.console(con)
+        self.TCOD_console_print_ex(con, x, y, console.bkgnd_flag, console.alignment, fmt)
+
+    TCOD_console_print_utf = TCOD_console_print
+
+    def TCOD_console_print_rect_ex(self, con, x, y, w, h, flag, alignment, fmt):
+        console = self.console(con)
+        lines = console.wrap(w, _value(fmt))
+        if h > 0:
+            lines = lines[:h]
+        for line in lines:
+            console.print_line(x, y, _value(flag), _value(alignment), line)
+            y += 1
+        return len(lines)
+
+    TCOD_console_print_rect_ex_utf = TCOD_console_print_rect_ex
+
+    def TCOD_console_print_rect(self, con, x, y, w, h, fmt):
+        console = self.console(con)
+        return self.TCOD_console_print_rect_ex(con, x, y, w, h, console.bkgnd_flag, console.alignment, fmt)
+
+    TCOD_console_print_rect_utf = TCOD_console_print_rect
+
+    def TCOD_console_get_height_rect(self, con, x, y, w, h, fmt):
+        lines = self.console(con).wrap(w, _value(fmt))
+        if h > 0:
+            return min(len(lines), h)
+        return len(lines)
+
+    TCOD_console_get_height_rect_utf = TCOD_console_get_height_rect
+
+    def TCOD_console_rect(self, con, x, y, w, h, clr, flag):
+        console = self.console(con)
+        for cy in range(max(y, 0), min(y + h, console.height)):
+            for cx in range(max(x, 0), min(x + w, console.width)):
+                i = cy * console.width + cx
+                if _value(clr):
+                    console.char[i] = ord(' ')
+                console.set_back(i, console.default_back, flag)
+
+    def TCOD_console_blit(self, src, x, y, w, h, dst, xdst, ydst, ffade, bfade):
+        source = self.console(src)
+        dest = self.console(dst)
+        ffade = _value(ffade)
+        bfade = _value(bfade)
+        if w == 0:
+            w = source.width
+        if h == 0:
+            h = source.height
+        if ffade >= 1.0 and bfade >= 1.0 and source.key_color is None:
+            # plain copy, one row slice at a time
+            x0 = max(x, x - xdst, 0)
+            x1 = min(x + w, source.width, x + dest.width - xdst)
+            if x1 <= x0:
+                return
+            for cy in range(h):
+                sy = y + cy
+                dy = ydst + cy
+                if not (0 <= sy < source.height and 0 <= dy < dest.height):
+                    continue
+                s0 = sy * source.width
+                d0 = dy * dest.width + xdst - x
+                dest.char[d0 + x0:d0 + x1] = source.char[s0 + x0:s0 + x1]
+                for channel in range(3):
+                    dest.fore[channel][d0 + x0:d0 + x1] = source.fore[channel][s0 + x0:s0 + x1]
+                    dest.back[channel][d0 + x0:d0 + x1] = source.back[channel][s0 + x0:s0 + x1]
+            return
+        for cy in range(h):
+            sy = y + cy
+            dy = ydst + cy
+            if not (0 <= sy < source.height and 0 <= dy < dest.height):
+                continue
+            for cx in range(w):
+                sx = x + cx
+                dx = xdst + cx
+                if not (0 <= sx < source.width and 0 <= dx < dest.width):
+                    continue
+                si = sy * source.width + sx
+                di = dy * dest.width + dx
+                back = source.get_back(si)
+                if source.key_color is not None and back == source.key_color:
+                    continue
+                if bfade >= 1.0:
+                    dest.set_back(di, back, BKGND_SET)
+                else:
+                    dest.set_back(di, back, BKGND_ALPH | (int(bfade * 255) << 8))
+                if ffade >= 1.0 or source.char[si] != ord(' '):
+                    dest.char[di] = source.char[si]
+                    dest.set_fore(di, source.get_fore(si))
+
+    def fill(self, channels, console, arrays):
+        n = console.width * console.height
+        for channel, arr in zip(channels, arrays):
+            values = arr[:n]
+            try:
+                channel[:] = bytearray(values)
+            except ValueError:
+                channel[:] = bytearray([_clamp(v) for v in values])
+
+    def TCOD_console_fill_background(self, con, r, g, b):
+        console = self.console(con)
+        self.fill(console.back, console, (r, g, b))
+
+    def TCOD_console_fill_foreground(self, con, r, g, b):
+        console = self.console(con)
+        self.fill(console.fore, console, (r, g, b))
+
+    def TCOD_console_fill_char(self, con, arr):
+        console = self.console(con)
+        n = console.width * console.height
+        if isinstance(arr, bytes):
+            arr = struct.unpack('%di' % n, arr)
+        console.char = list(arr[:n])
+
+    # input
+    def TCOD_console_wait_for_keypress_wrapper(self, key, flush):
+        # with nothing left to read, the "window" gets closed so the game loops end
+        if not self.keys:
+            self.window_closed = True
+        self.fill_key(key._obj)
+
+    def TCOD_console_check_for_keypress_wrapper(self, key, flags):
+        self.fill_key(key._obj)
+
+    def TCOD_console_is_key_pressed(self, key):
+        return False
+
+    def TCOD_console_set_keyboard_repeat(self, initial_delay, interval):
+        pass
+
+    def TCOD_console_disable_keyboard_repeat(self):
+        pass
+
+    def TCOD_sys_check_for_event(self, mask, key, mouse):
+        mask = _value(mask)
+        return self.fill_key(key._obj, mask) | self.fill_mouse(mouse._obj, mask)
+
+    def TCOD_sys_wait_for_event(self, mask, key, mouse, flush):
+        if not self.keys and not self.mouse_events:
+            self.window_closed = True
+        return self.TCOD_sys_check_for_event(mask, key, mouse)
+
+    def TCOD_mouse_get_status_wrapper(self, mouse):
+        self.fill_mouse(mouse._obj, EVENT_MOUSE)
+
+    def TCOD_mouse_show_cursor(self, visible):
+        pass
+
+    def TCOD_mouse_is_cursor_visible(self):
+        return False
+
+    def TCOD_mouse_move(self, x, y):
+        pass
+
+    # sys module
+    def TCOD_sys_set_fps(self, fps):
+        self.fps = fps
+
+    def TCOD_sys_get_fps(self):
+        return self.fps
+
+    def TCOD_sys_get_last_frame_length(self):
+        return self.last_frame_length
+
+    def TCOD_sys_sleep_milli(self, val):
+        pass
+
+    def TCOD_sys_elapsed_milli(self):
+        return int((time.time() - self.start) * 1000)
+
+    def TCOD_sys_elapsed_seconds(self):
+        return time.time() - self.start
+
+    def TCOD_sys_set_renderer(self, renderer):
+        pass
+
+    def TCOD_sys_get_renderer(self):
+        return 2
+
+    def TCOD_sys_save_screenshot(self, name):
+        pass
+
+    def TCOD_sys_get_current_resolution(self, w, h):
+        w._obj.value = 640
+        h._obj.value = 500
+
+    def TCOD_sys_get_char_size(self, w, h):
+        w._obj.value = 8
+        h._obj.value = 8
+
+    # image module
+    def TCOD_image_load(self, filename):
+        handle = self.new_handle()
+        self.images[handle] = _value(filename)
+        return handle
+
+    def TCOD_image_new(self, width, height):
+        handle = self.new_handle()
+        self.images[handle] = (width, height)
+        return handle
+
+    def TCOD_image_blit_2x(self, image, console, dx, dy, sx, sy, w, h):
+        pass
+
+    def TCOD_image_blit(self, image, console, x, y, bkgnd_flag, scalex, scaley, angle):
+        pass
+
+    def TCOD_image_blit_rect(self, image, console, x, y, w, h, bkgnd_flag):
+        pass
+
+    def TCOD_image_delete(self, image):
+        self.images.pop(image, None)
+
+    # random module
+    def generator(self, rnd):
+        return self.generators[_handle(rnd)]
+
+    def TCOD_random_get_instance(self):
+        return 0
+
+    def TCOD_random_new(self, algo):
+        handle = self.new_handle()
+        self.generators[handle] = random.Random()
+        return handle
+
+    def TCOD_random_new_from_seed(self, algo, seed):
+        handle = self.new_handle()
+        self.generators[handle] = random.Random(_value(seed))
+        return handle
+
+    def TCOD_random_set_distribution(self, rnd, dist):
+        pass
+
+    def TCOD_random_get_int(self, rnd, mi, ma):
+        if mi > ma:
+            mi, ma = ma, mi
+        return self.generator(rnd).randint(mi, ma)
+
+    def TCOD_random_get_float(self, rnd, mi, ma):
+        return self.generator(rnd).uniform(_value(mi), _value(ma))
+
+    TCOD_random_get_double = TCOD_random_get_float
+
+    def TCOD_random_save(self, rnd):
+        handle = self.new_handle()
+        self.generators[handle] = random.Random()
+        self.generators[handle].setstate(self.generator(rnd).getstate())
+        return handle
+
+    def TCOD_random_restore(self, rnd, backup):
+        self.generator(rnd).setstate(self.generator(backup).getstate())
+
+    def TCOD_random_delete(self, rnd):
+        if _handle(rnd) != 0:
+            self.generators.pop(_handle(rnd), None)
+
+    # fov module
+    def map(self, m):
+        return self.maps[_handle(m)]
+
+    def TCOD_map_new(self, w, h):
+        m = Map(w, h)
+        handle = addressof(m.header)
+        self.maps[handle] = m
+        return handle
+
+    def TCOD_map_delete(self, m):
+        self.maps.pop(_handle(m), None)
+
+    def TCOD_map_copy(self, source, dest):
+        self.map(dest).cells[:] = self.map(source).cells
+
+    def TCOD_map_get_width(self, m):
+        return self.map(m).width
+
+    def TCOD_map_get_height(self, m):
+        return self.map(m).height
+
+    def TCOD_map_clear(self, m, walkable, transparent):
+        cell = (CELL_TRANSPARENT if _value(transparent) else 0) | (CELL_WALKABLE if _value(walkable) else 0)
+        cells = self.map(m).cells
+        cells[:] = bytearray([cell]) * len(cells)
+
+    def TCOD_map_set_properties(self, m, x, y, transparent, walkable):
+        fmap = self.map(m)
+        i = y * fmap.width + x
+        cell = fmap.cells[i] & CELL_FOV
+        if _value(transparent):
+            cell |= CELL_TRANSPARENT
+        if _value(walkable):
+            cell |= CELL_WALKABLE
+        fmap.cells[i] = cell
+
+    def TCOD_map_set_in_fov(self, m, x, y, fov):
+        fmap = self.map(m)
+        i = y * fmap.width + x
+        if _value(fov):
+            fmap.cells[i] |= CELL_FOV
+        else:
+            fmap.cells[i] &= ~CELL_FOV & 0xff
+
+    def TCOD_map_is_in_fov(self, m, x, y):
+        fmap = self.map(m)
+        return bool(fmap.cells[y * fmap.width + x] & CELL_FOV)
+
+    def TCOD_map_is_transparent(self, m, x, y):
+        fmap = self.map(m)
+        return bool(fmap.cells[y * fmap.width + x] & CELL_TRANSPARENT)
+
+    def TCOD_map_is_walkable(self, m, x, y):
+        fmap = self.map(m)
+        return bool(fmap.cells[y * fmap.width + x] & CELL_WALKABLE)
+
+    def TCOD_map_compute_fov(self, m, x, y, radius, light_walls, algo):
+        algo = _value(algo)
+        if algo == FOV_SHADOW:
+            return self.compute_fov_shadow(self.map(m), x, y, _value(radius), _value(light_walls))
+        if algo != FOV_BASIC:
+            raise NotImplementedError('FOV algorithm %d is not available in the headless libtcod backend, '
+                                      'only FOV_BASIC and FOV_SHADOW are.' % algo)
+        # FOV_BASIC: rays cast from the origin to each cell on the edge of
+        # the radius' bounding box
+        fmap = self.map(m)
+        radius = _value(radius)
+        light_walls = _value(light_walls)
+        w = fmap.width
+        h = fmap.height
+        cells = fmap.cells
+        cells[:] = cells.translate(_CLEAR_FOV)
+        if radius > 0:
+            xmin, ymin = max(0, x - radius), max(0, y - radius)
+            xmax, ymax = min(w, x + radius + 1), min(h, y + radius + 1)
+        else:
+            xmin, ymin, xmax, ymax = 0, 0, w, h
+        r2 = radius * radius
+        cells[y * w + x] |= CELL_FOV
+        edge = ([(xd, ymin) for xd in range(xmin, xmax)] +
+                [(xmax - 1, yd) for yd in range(ymin, ymax)] +
+                [(xd, ymax - 1) for xd in range(xmin, xmax)] +
+                [(xmin, yd) for yd in range(ymin, ymax)])
+        for (xd, yd) in edge:
+            for (cx, cy) in _line(x, y, xd, yd):
+                if r2 > 0 and (cx - x) ** 2 + (cy - y) ** 2 > r2:
+                    break
+                if not (0 <= cx < w and 0 <= cy < h):
+                    break
+                i = cy * w + cx
+                if not cells[i] & CELL_TRANSPARENT:
+                    if light_walls:
+                        cells[i] |= CELL_FOV
+                    break
+                cells[i] |= CELL_FOV
+        if light_walls:
+            # light the walls next to a lit floor cell on the side facing the origin
+            for cy in range(ymin, ymax):
+                for cx in range(xmin, xmax):
+                    i = cy * w + cx
+                    if cells[i] & (CELL_TRANSPARENT | CELL_FOV):
+                        continue
+                    if r2 > 0 and (cx - x) ** 2 + (cy - y) ** 2 > r2:
+                        continue
+                    sx = (cx < x) - (cx > x)
+                    sy = (cy < y) - (cy > y)
+                    for (nx, ny) in ((cx + sx, cy), (cx, cy + sy), (cx + sx, cy + sy)):
+                        n = cells[ny * w + nx]
+                        if (nx, ny) != (cx, cy) and n & CELL_TRANSPARENT and n & CELL_FOV:
+                            cells[i] |= CELL_FOV
+                            break
+
+
+    def compute_fov_shadow(self, fmap, x, y, radius, light_walls):
+        # FOV_SHADOW: libtcod's recursive shadowcasting, octant by octant
+        cells = fmap.cells
+        cells[:] = cells.translate(_CLEAR_FOV)
+        if radius == 0:
+            (rx, ry) = (max(fmap.width - x, x), max(fmap.height - y, y))
+            radius = int((rx * rx + ry * ry) ** 0.5) + 1
+        for (xx, xy, yx, yy) in _OCTANTS:
+            _cast_light(fmap, x, y, 1, 1.0, 0.0, radius, radius * radius, xx, xy, yx, yy, light_walls)
+        cells[y * fmap.width + x] |= CELL_FOV
+
+
+_CLEAR_FOV = bytes(bytearray([i & ~CELL_FOV for i in range(256)]))
+
+
+def _float(v):
+    # v rounded to a C float, as the slopes of libtcod's shadowcasting are
+    return struct.unpack('f', struct.pack('f', v))[0]
+
+
+def _cast_light(fmap, cx, cy, row, start, end, radius, r2, xx, xy, yx, yy, light_walls):
+    # light one octant from row on, between the slopes start and end,
+    # recursing into the part of the next rows a wall leaves in view
+    if start < end:
+        return
+    (w, h, cells) = (fmap.width, fmap.height, fmap.cells)
+    new_start = 0.0
+    for j in range(row, radius + 1):
+        dx = -j - 1
+        dy = -j
+        blocked = False
+        while dx <= 0:
+            dx += 1
+            x = cx + dx * xx + dy * xy
+            y = cy + dx * yx + dy * yy
+            if not (0 <= x < w and 0 <= y < h):
+                continue
+            i = y * w + x
+            l_slope = _float((dx - 0.5) / (dy + 0.5))
+            r_slope = _float((dx + 0.5) / (dy - 0.5))
+            if start < r_slope:
+                continue
+            elif end > l_slope:
+                break
+            transparent = cells[i] & CELL_TRANSPARENT
+            if dx * dx + dy * dy <= r2 and (light_walls or transparent):
+                cells[i] |= CELL_FOV
+            if blocked:
+                if not transparent:
+                    new_start = r_slope
+                    continue
+                blocked = False
+                start = new_start
+            elif not transparent and j < radius:
+                blocked = True
+                _cast_light(fmap, cx, cy, j + 1, start, l_slope, radius, r2, xx, xy, yx, yy, light_walls)
+                new_start = r_slope
+        if blocked:
+            break
+
+
+def _line(xo, yo, xd, yd):
+    # the cells of libtcod's bresenham line from (xo, yo) to (xd, yd), origin excluded
+    dx = xd - xo
+    dy = yd - yo
+    sx = (dx > 0) - (dx < 0)
+    sy = (dy > 0) - (dy < 0)
+    x, y = xo, yo
+    if sx * dx > sy * dy:
+        e = sx * dx
+        dx *= 2
+        dy *= 2
+        while x != xd:
+            x += sx
+            e -= sy * dy
+            if e < 0:
+                y += sy
+                e += sx * dx
+            yield x, y
+    else:
+        e = sy * dy
+        dx *= 2
+        dy *= 2
+        while y != yd:
+            y += sy
+            e -= sx * dx
+            if e < 0:
+                x += sx
+                e += sy * dy
+            yield x, y
+
+
+lib = HeadlessLibrary()
+
+
+def push_key(vk, c=0, **modifiers):
+    # queue a key press for the game to read
+    lib.push_key(vk, c, **modifiers)
+
+
+def push_char(char):
+    # queue a printable key press
+    lib.push_key(KEY_CHAR, ord(char))
+
+
+def push_mouse(cx, cy, lbutton_pressed=False, rbutton_pressed=False):
+    # queue a mouse event at console cell (cx, cy)
+    lib.push_mouse(cx, cy, lbutton_pressed, rbutton_pressed)
@@ -25,9 +25,13 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import os
 import sys
+import atexit
+import time
 import ctypes
 import struct
+import types
 from ctypes import *
 
 if not hasattr(ctypes, "c_bool"):   # for Python < 2.6
@@ -43,7 +47,13 @@ LINUX=False
 MAC=False
 MINGW=False
 MSVC=False
-if sys.platform.find('linux') != -1:
+HEADLESS=False
+if os.environ.get('LIBTCOD_BACKEND') == 'headless':
+    # pure Python stand-in for the C library, no display needed
+    import libtcodheadless
+    _lib = libtcodheadless.lib
+    HEADLESS=True
+elif sys.platform.find('linux') != -1:
     _lib = ctypes.cdll['./libtcod.so']
     LINUX=True
 elif sys.platform.find('darwin') != -1:
@@ -1543,6 +1553,101 @@ def map_get_width(map):
 def map_get_height(map):
     return _lib.TCOD_map_get_height(map)
 
+# bulk access to a whole map. libtcod keeps a map as a small header followed
+# by a pointer to width*height cells. depending on how the library was
+# compiled a cell is either one byte of bit fields (transparent, walkable,
+# fov) or three bools, so the layout is probed once on a tiny map before the
+# cells are written directly.
+class _CMap(Structure):
+    _fields_=[('width', c_int),
+              ('height', c_int),
+              ('nbcells', c_int),
+              ('cells', c_void_p),
+              ]
+
+MAP_CELLS_BITS = 1     # one byte per cell: transparent | walkable << 1 | fov << 2
+MAP_CELLS_BOOLS = 2    # three bytes per cell: transparent, walkable, fov
+MAP_CELLS_UNKNOWN = 3  # don't touch the cells, go through map_set_properties
+
+_map_cells_layout = None
+_BOOL_BYTES = bytes(bytearray([0] + [1] * 255))
+_WALKABLE_BIT = bytes(bytearray([0, 2] + [0] * 254))
+_FOV_BIT = bytes(bytearray([(i >> 2) & 1 for i in range(256)]))
+
+def _map_struct(m):
+    return cast(c_void_p(m), POINTER(_CMap)).contents
+
+def _map_get_cells_layout():
+    global _map_cells_layout
+    if _map_cells_layout is None:
+        _map_cells_layout = MAP_CELLS_UNKNOWN
+        m = map_new(2, 1)
+        map_set_properties(m, 0, 0, True, False)
+        map_set_properties(m, 1, 0, False, True)
+        _lib.TCOD_map_set_in_fov(m, 1, 0, c_bool(True))
+        cmap = _map_struct(m)
+        if cmap.width == 2 and cmap.height == 1 and cmap.nbcells == 2:
+            cells = bytearray(string_at(cmap.cells, 2))
+            if cells == bytearray([1, 6]):
+                _map_cells_layout = MAP_CELLS_BITS
+            elif cells == bytearray([1, 0]):
+                cells = bytearray(string_at(cmap.cells, 6))
+                if cells == bytearray([1, 0, 0, 0, 1, 1]):
+                    _map_cells_layout = MAP_CELLS_BOOLS
+        map_delete(m)
+    return _map_cells_layout
+
+def _map_cell_bytes(a, size):
+    # one byte per cell, 0 or 1, from any buffer or sequence of truth values
+    if numpy_available and isinstance(a, numpy.ndarray):
+        a = numpy.ascontiguousarray(a, dtype=numpy.bool_)
+    a = bytearray(a)
+    if len(a) != size:
+        raise ValueError('Expected %d cells, got %d.' % (size, len(a)))
+    return a.translate(_BOOL_BYTES)
+
+def map_set_properties_array(m, transparent, walkable):
+    # set the properties of every cell at once. transparent and walkable hold
+    # width*height values, row by row (index y*width+x), and can be NumPy
+    # arrays, bytearrays or any other buffer-protocol object or sequence.
+    # the fov flags of the map are cleared.
+    w = map_get_width(m)
+    h = map_get_height(m)
+    size = w * h
+    transparent = _map_cell_bytes(transparent, size)
+    walkable = _map_cell_bytes(walkable, size)
+    layout = _map_get_cells_layout()
+    if layout == MAP_CELLS_BITS:
+        if numpy_available:
+            cells = bytearray(numpy.frombuffer(transparent, dtype=numpy.uint8) |
+                              (numpy.frombuffer(walkable, dtype=numpy.uint8) << 1))
+        else:
+            cells = bytearray(map(int.__or__, transparent, walkable.translate(_WALKABLE_BIT)))
+    elif layout == MAP_CELLS_BOOLS:
+        cells = bytearray(3 * size)
+        cells[0::3] = transparent
+        cells[1::3] = walkable
+    else:
+        for y in range(h):
+            for x in range(w):
+                i = y * w + x
+                map_set_properties(m, x, y, transparent[i], walkable[i])
+        return
+    memmove(_map_struct(m).cells, (c_char * len(cells)).from_buffer(cells), len(cells))
+
+def map_get_fov_array(m):
+    # return the fov flags of every cell at once, as a bytearray of
+    # width*height values (0 or 1), row by row (index y*width+x)
+    w = map_get_width(m)
+    h = map_get_height(m)
+    size = w * h
+    layout = _map_get_cells_layout()
+    if layout == MAP_CELLS_BITS:
+        return bytearray(string_at(_map_struct(m).cells, size)).translate(_FOV_BIT)
+    elif layout == MAP_CELLS_BOOLS:
+        return bytearray(string_at(_map_struct(m).cells, 3 * size))[2::3].translate(_BOOL_BYTES)
+    return bytearray([map_is_in_fov(m, x, y) for y in range(h) for x in range(w)])
+
 ############################
 # pathfinding module
 ############################
@@ -1955,3 +2060,160 @@ def namegen_destroy() :
     _lib.TCOD_namegen_destroy()
 
 
+############################
+# headless backend support
+############################
+# the headless backend doesn't implement every entry point. the wrappers that
+# need one it lacks are left out of this module as soon as it is selected, so
+# a program using them fails when it imports or looks them up instead of
+# halfway through a game. HEADLESS_UNSUPPORTED lists them, and
+# HEADLESS_FOV_ALGORITHMS the FOV algorithms map_compute_fov can use.
+HEADLESS_UNSUPPORTED = []
+HEADLESS_FOV_ALGORITHMS = ()
+
+def _entry_points(code):
+    # the TCOD_* names a function's code (nested functions included) refers to
+    names = set(name for name in code.co_names if name.startswith('TCOD_'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _entry_points(const)
+    return names
+
+if HEADLESS:
+    HEADLESS_FOV_ALGORITHMS = libtcodheadless.FOV_ALGORITHMS
+    for (_name, _function) in sorted(globals().items()):
+        if (isinstance(_function, types.FunctionType) and _function.__module__ == __name__ and
+                not all(_lib.supports(entry) for entry in _entry_points(_function.__code__))):
+            HEADLESS_UNSUPPORTED.append(_name)
+    for _name in HEADLESS_UNSUPPORTED:
+        del globals()[_name]
+
+
+############################
+# call instrumentation
+############################
+# opt-in counting and timing of the calls into the C library (or its headless
+# stand-in), per entry point and per frame, a frame ending with each
+# console_flush. turn it on with instrument(), or by setting the
+# LIBTCOD_INSTRUMENT environment variable, which also prints call_report() to
+# stderr when the program exits. while it is off, nothing is wrapped and calls
+# cost what they always did.
+if sys.platform == 'win32' and hasattr(time, 'clock'):
+    _timer = time.clock
+else:
+    _timer = getattr(time, 'perf_counter', time.time)
+
+class _CallStats(object):
+    # [calls, seconds] per entry point name, for the frame going on, the last whole frame and all frames before
+    def __init__(self):
+        self.frame = {}
+        self.last_frame = {}
+        self.totals = {}
+        self.frames = 0
+
+    def end_frame(self):
+        for (name, (calls, seconds)) in self.frame.items():
+            total = self.totals.setdefault(name, [0, 0.0])
+            total[0] += calls
+            total[1] += seconds
+        self.last_frame = self.frame
+        self.frame = {}
+        self.frames += 1
+
+_call_stats = _CallStats()
+
+class _InstrumentedFunction(object):
+    # a C function that counts and times its calls. restype, argtypes and the rest go to the function itself
+    def __init__(self, name, func):
+        self.__dict__['name'] = name
+        self.__dict__['func'] = func
+        self.__dict__['ends_frame'] = name == 'TCOD_console_flush'
+
+    def __call__(self, *args):
+        start = _timer()
+        try:
+            return self.func(*args)
+        finally:
+            seconds = _timer() - start
+            entry = _call_stats.frame.get(self.name)
+            if entry is None:
+                _call_stats.frame[self.name] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+            if self.ends_frame:
+                _call_stats.end_frame()
+
+    def __getattr__(self, name):
+        return getattr(self.func, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.func, name, value)
+
+class _InstrumentedLibrary(object):
+    # stands in for _lib, handing out an _InstrumentedFunction for each of its entry points
+    def __init__(self, lib):
+        self.__dict__['lib'] = lib
+
+    def __getattr__(self, name):
+        function = _InstrumentedFunction(name, getattr(self.lib, name))
+        self.__dict__[name] = function
+        return function
+
+    def __setattr__(self, name, value):
+        setattr(self.lib, name, value)
+        self.__dict__.pop(name, None)
+
+def instrument():
+    global _lib
+    if not isinstance(_lib, _InstrumentedLibrary):
+        _lib = _InstrumentedLibrary(_lib)
+
+def uninstrument():
+    global _lib
+    if isinstance(_lib, _InstrumentedLibrary):
+        _lib = _lib.lib
+
+def is_instrumented():
+    return isinstance(_lib, _InstrumentedLibrary)
+
+def call_stats():
+    # {entry point name: (calls, seconds)} since instrument() or the last reset, the frame going on included
+    stats = dict((name, tuple(total)) for (name, total) in _call_stats.totals.items())
+    for (name, (calls, seconds)) in _call_stats.frame.items():
+        (total_calls, total_seconds) = stats.get(name, (0, 0.0))
+        stats[name] = (total_calls + calls, total_seconds + seconds)
+    return stats
+
+def frame_call_stats():
+    # {entry point name: (calls, seconds)} of the last whole frame
+    return dict((name, tuple(entry)) for (name, entry) in _call_stats.last_frame.items())
+
+def frame_count():
+    return _call_stats.frames
+
+def reset_call_stats():
+    global _call_stats
+    _call_stats = _CallStats()
+
+def call_report(limit=25):
+    # a table of the entry points that took the most time, as a string
+    stats = call_stats()
+    frames = max(_call_stats.frames, 1)
+    total = sum(seconds for (calls, seconds) in stats.values()) or 1e-12
+    lines = ['libtcod calls over %d frames, %.1f ms in all' % (_call_stats.frames, 1000.0 * total),
+             '%-44s %10s %10s %10s %9s %6s' % ('function', 'calls', 'per frame', 'total ms', 'us/call', '%')]
+    ranked = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+    for (name, (calls, seconds)) in ranked[:limit]:
+        lines.append('%-44s %10d %10.1f %10.2f %9.2f %6.1f' % (name, calls, float(calls) / frames, 1000.0 * seconds,
+                                                              1000000.0 * seconds / calls, 100.0 * seconds / total))
+    if len(ranked) > limit:
+        lines.append('(%d more)' % (len(ranked) - limit))
+    return '\n'.join(lines) + '\n'
+
+def _print_call_report():
+    sys.stderr.write(call_report())
+
+if os.environ.get('LIBTCOD_INSTRUMENT'):
+    instrument()
+    atexit.register(_print_call_report)
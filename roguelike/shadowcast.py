@@ -0,0 +1,181 @@
+#
+# symmetric shadowcasting field of view, in plain Python
+#
+# a drop-in for the FOV map functions of libtcodpy (map_new,
+# map_set_properties, map_set_properties_array, map_compute_fov,
+# map_is_in_fov, map_get_fov_array and friends), so the game can pick its
+# FOV engine by module. the FOV is worked out quadrant by quadrant, row by
+# row, following Albert Ford's "Symmetric Shadowcasting": a floor tile is in
+# view of the origin exactly when the origin is in view of it. slopes are
+# kept as exact fractions of two ints, so there is no float rounding at the
+# edges of a shadow.
+#
+# maps are plain bytearrays of width*height cells laid out row by row
+# (index y*width+x), like libtcod's. the tables of what a radius covers are
+# worked out once per radius (see precompute) instead of testing
+# dx*dx + dy*dy <= r*r for every tile of every scan.
+#
+
+try:
+    import numpy
+    numpy_available = True
+except ImportError:
+    numpy_available = False
+
+FOV_SYMMETRIC_SHADOWCAST = 0  # the only algorithm there is, whatever map_compute_fov is asked for
+
+# (dx, dy) of one step deeper and of one column to the right, for the quadrants
+# north, east, south and west of the origin
+QUADRANTS = ((0, -1, 1, 0), (1, 0, 0, 1), (0, 1, 1, 0), (-1, 0, 0, 1))
+
+_radius_tables = {}
+
+
+class FovMap(object):
+    # what libtcod's map_new returns: transparent, walkable and fov flags, one byte per cell
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.transparent = bytearray(width * height)
+        self.walkable = bytearray(width * height)
+        self.fov = bytearray(width * height)
+
+
+def precompute(radius):
+    # the widest column still inside the radius, for every depth of a quadrant scan (0 for no limit)
+    tables = _radius_tables.get(radius)
+    if tables is None:
+        if radius > 0:
+            tables = [_isqrt(radius * radius - depth * depth) for depth in range(radius + 1)]
+        else:
+            tables = None
+        _radius_tables[radius] = tables
+    return tables
+
+
+def _isqrt(n):
+    root = int(n ** 0.5)
+    while root * root > n:
+        root -= 1
+    while (root + 1) * (root + 1) <= n:
+        root += 1
+    return root
+
+
+def map_new(w, h):
+    return FovMap(w, h)
+
+
+def map_copy(source, dest):
+    dest.width = source.width
+    dest.height = source.height
+    dest.transparent = bytearray(source.transparent)
+    dest.walkable = bytearray(source.walkable)
+    dest.fov = bytearray(source.fov)
+
+
+def map_set_properties(m, x, y, isTrans, isWalk):
+    i = y * m.width + x
+    m.transparent[i] = bool(isTrans)
+    m.walkable[i] = bool(isWalk)
+
+
+def map_set_properties_array(m, transparent, walkable):
+    # set the transparent and walkable flags of every cell at once, from two
+    # sequences of width*height values (0 or 1), row by row
+    m.transparent[:] = bytearray(transparent)
+    m.walkable[:] = bytearray(walkable)
+
+
+def map_clear(m, transparent=False, walkable=False):
+    size = m.width * m.height
+    m.transparent = bytearray([bool(transparent)]) * size
+    m.walkable = bytearray([bool(walkable)]) * size
+    m.fov = bytearray(size)
+
+
+def map_compute_fov(m, x, y, radius=0, light_walls=True, algo=FOV_SYMMETRIC_SHADOWCAST):
+    w = m.width
+    h = m.height
+    fov = m.fov = bytearray(w * h)
+    limits = precompute(radius) or [max(w, h)] * (max(w, h) + 1)
+    fov[y * w + x] = 1
+    for quadrant in QUADRANTS:
+        _scan_quadrant(m, fov, x, y, quadrant, limits, light_walls)
+
+
+def _scan_quadrant(m, fov, ox, oy, quadrant, limits, light_walls):
+    # rows waiting to be scanned, as (depth, start slope, end slope), each slope an
+    # int fraction (numerator, denominator) of columns per depth
+    (rdx, rdy, cdx, cdy) = quadrant
+    (w, h) = (m.width, m.height)
+    transparent = m.transparent
+    max_depth = len(limits) - 1
+    rows = [(1, -1, 1, 1, 1)]
+    while rows:
+        (depth, sn, sd, en, ed) = rows.pop()
+        if depth > max_depth:
+            continue
+        limit = limits[depth]
+        # the columns of the row between the slopes, rounding ties towards the middle
+        min_col = (2 * depth * sn + sd) // (2 * sd)
+        max_col = -((ed - 2 * depth * en) // (2 * ed))
+        (bx, by) = (ox + rdx * depth, oy + rdy * depth)
+        prev_wall = None
+        for col in range(min_col, max_col + 1):
+            (x, y) = (bx + cdx * col, by + cdy * col)
+            inside = 0 <= x < w and 0 <= y < h
+            wall = not inside or not transparent[y * w + x]
+            if inside and -limit <= col <= limit:
+                if wall:
+                    if light_walls:
+                        fov[y * w + x] = 1
+                elif col * sd >= depth * sn and col * ed <= depth * en:
+                    # symmetric: the tile's center is between the slopes
+                    fov[y * w + x] = 1
+            if prev_wall and not wall:
+                # coming out of a shadow, the row starts again from this tile's left edge
+                (sn, sd) = (2 * col - 1, 2 * depth)
+            elif prev_wall is False and wall:
+                # going into a shadow, the floor so far goes on into the next row
+                rows.append((depth + 1, sn, sd, 2 * col - 1, 2 * depth))
+            prev_wall = wall
+        if prev_wall is False:
+            rows.append((depth + 1, sn, sd, en, ed))
+
+
+def map_is_in_fov(m, x, y):
+    return bool(m.fov[y * m.width + x])
+
+
+def map_is_transparent(m, x, y):
+    return bool(m.transparent[y * m.width + x])
+
+
+def map_is_walkable(m, x, y):
+    return bool(m.walkable[y * m.width + x])
+
+
+def map_get_width(m):
+    return m.width
+
+
+def map_get_height(m):
+    return m.height
+
+
+def map_get_fov_array(m):
+    # the fov flags of every cell at once, as a bytearray of width*height
+    # values (0 or 1), row by row (index y*width+x)
+    return bytearray(m.fov)
+
+
+def map_get_fov_mask(m):
+    # the fov flags as a height x width numpy array of bools, sharing memory with the map
+    if not numpy_available:
+        raise ImportError('map_get_fov_mask needs numpy')
+    return numpy.frombuffer(m.fov, dtype=numpy.bool_).reshape(m.height, m.width)
+
+
+def map_delete(m):
+    pass